@@ -0,0 +1,241 @@
+# ASGI entry point: an asyncio server in front of the same job pipeline as batch_download.py.
+#
+# Submissions and job polling are answered on the event loop, so idle connections cost a
+# coroutine rather than a thread, and GET /jobs/<id>?wait=<seconds> long-polls until the job
+# finishes instead of making clients poll in a tight loop. Downloads, uploads and Sheets writes
+# keep running on the job worker threads; every other route is served by the Flask app on a
+# small thread pool.
+#
+#   uvicorn asgi:app --host 0.0.0.0 --port $PORT
+#   python asgi.py
+
+import asyncio
+import io
+import json
+import logging
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+import batch_download
+from batch_download import FINISHED_JOB_STATUSES, count_pending_jobs, get_job, resume_jobs, submit_job
+
+LONG_POLL_MAX = float(os.environ.get('LONG_POLL_MAX', 60))  # Longest ?wait= a client may ask for, in seconds
+WSGI_THREADS = int(os.environ.get('WSGI_THREADS', 8))  # Threads serving the routes delegated to Flask
+
+wsgi_executor = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix='asgi-wsgi')
+
+# Job Waiters: worker threads report transitions through batch_download.job_status_listeners,
+# which wakes the coroutines long-polling that job on their own event loop. In shared mode the
+# jobs run in worker processes instead, so one poller task reads the journal for every waited
+# job at once and wakes the waiters whose job has finished.
+
+job_waiters = {}  # job_id -> set of (loop, future)
+job_waiters_lock = threading.Lock()
+job_poller = None
+
+async def run_blocking(function, *args):
+    # In shared mode job state lives in SQLite, so reads go to a thread instead of the event loop
+    if batch_download.JOB_QUEUE_MODE != 'shared':
+        return function(*args)
+    return await asyncio.get_running_loop().run_in_executor(wsgi_executor, function, *args)
+
+def notify_job_waiters(job_id, status):
+    with job_waiters_lock:
+        waiters = job_waiters.pop(job_id, ())
+    for loop, future in waiters:
+        loop.call_soon_threadsafe(resolve_waiter, future, status)
+
+def resolve_waiter(future, status):
+    if not future.done():
+        future.set_result(status)
+
+batch_download.job_status_listeners.append(notify_job_waiters)
+
+async def run_job_poller():
+    global job_poller
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(batch_download.JOB_POLL_INTERVAL)
+        with job_waiters_lock:
+            job_ids = list(job_waiters)
+            if not job_ids:
+                job_poller = None
+                return
+        try:
+            finished_jobs = await loop.run_in_executor(wsgi_executor, batch_download.load_finished_jobs, job_ids)
+        except Exception as e:
+            logging.error("Error polling job journal: %s", e)
+            continue
+        for job_id, status in finished_jobs.items():
+            notify_job_waiters(job_id, status)
+
+def start_job_poller():
+    global job_poller
+    with job_waiters_lock:
+        if job_poller is None:
+            job_poller = asyncio.get_running_loop().create_task(run_job_poller())
+
+async def wait_for_job(job_id, timeout):
+    # Returns the job once it has finished or the timeout has passed, whichever comes first
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        future = loop.create_future()
+        waiter = (loop, future)
+        with job_waiters_lock:
+            job_waiters.setdefault(job_id, set()).add(waiter)
+        try:
+            # Registered before reading, so a transition in between still wakes us
+            job = await run_blocking(get_job, job_id)
+            remaining = deadline - loop.time()
+            if not job or job['status'] in FINISHED_JOB_STATUSES or remaining <= 0:
+                return job
+            if batch_download.JOB_QUEUE_MODE == 'shared':
+                start_job_poller()
+            try:
+                await asyncio.wait_for(future, remaining)
+            except asyncio.TimeoutError:
+                pass
+        finally:
+            with job_waiters_lock:
+                waiters = job_waiters.get(job_id)
+                if waiters:
+                    waiters.discard(waiter)
+                    if not waiters:
+                        job_waiters.pop(job_id, None)
+
+# Requests and Responses
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+async def send_response(send, status, body, content_type):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', content_type.encode('latin-1')),
+                            (b'content-length', str(len(body)).encode('latin-1'))]})
+    await send({'type': 'http.response.body', 'body': body})
+
+async def send_json(send, status, payload):
+    await send_response(send, status, json.dumps(payload).encode('utf-8'), 'application/json')
+
+def build_environ(scope, body):
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+def run_wsgi(environ):
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = headers
+
+    result = batch_download.app(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return response['status'], response['headers'], body
+
+async def call_flask(scope, receive, send):
+    body = await read_body(receive)
+    status, headers, body = await asyncio.get_running_loop().run_in_executor(
+        wsgi_executor, run_wsgi, build_environ(scope, body))
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]})
+    await send({'type': 'http.response.body', 'body': body})
+
+# Routes
+
+async def process_video(scope, receive, send):
+    logging.debug("Process video route accessed.")
+    try:
+        payload = json.loads(await read_body(receive) or b'{}')
+    except ValueError:
+        return await send_json(send, 400, {'error': 'Invalid JSON'})
+    url = payload.get('url') if isinstance(payload, dict) else None
+    if not url:
+        return await send_json(send, 400, {'error': 'Missing url'})
+    if await run_blocking(count_pending_jobs) >= batch_download.MAX_PENDING_JOBS:
+        logging.warning("Job queue is full, rejecting submission.")
+        return await send_json(send, 503, {'error': 'Job queue is full, try again later'})
+    # The journal write is synchronous, so keep it off the event loop
+    job = await asyncio.get_running_loop().run_in_executor(wsgi_executor, submit_job, url)
+    await send_json(send, 202, {'message': 'Processing started', 'job_id': job['id'], 'status': job['status']})
+
+async def job_status(scope, receive, send, job_id):
+    logging.debug("Job status route accessed: %s", job_id)
+    query = dict(parse_qsl(scope['query_string'].decode('latin-1')))
+    try:
+        wait = min(max(float(query.get('wait', 0)), 0), LONG_POLL_MAX)
+    except ValueError:
+        return await send_json(send, 400, {'error': 'Invalid wait'})
+    job = await wait_for_job(job_id, wait) if wait else await run_blocking(get_job, job_id)
+    if not job:
+        return await send_json(send, 404, {'error': 'Job not found'})
+    await send_json(send, 200, job)
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            if batch_download.RESUME_JOBS:
+                await asyncio.get_running_loop().run_in_executor(wsgi_executor, resume_jobs)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            wsgi_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+    path = scope['path'].rstrip('/') or '/'
+    if scope['method'] == 'POST' and path == '/process':
+        return await process_video(scope, receive, send)
+    if scope['method'] == 'GET' and path.startswith('/jobs/') and path.count('/') == 2:
+        return await job_status(scope, receive, send, path[len('/jobs/'):])
+    await call_flask(scope, receive, send)
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", 8000)))
@@ -1,26 +1,42 @@
 # Import necessary libraries
+import argparse
+import atexit
 import os
+import sys
 import json
+import hashlib
+import zlib
 import yt_dlp
+from yt_dlp.networking import Request as YdlRequest
 import requests
 import time
 import re
-from datetime import datetime
+import sqlite3
+import queue
+import random
+import threading
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaFileUpload
+from googleapiclient.http import HttpRequest, MediaFileUpload, MediaUpload
 import pickle
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 import logging
-from urllib.parse import urlparse
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
 
 # Configure logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'DEBUG').upper(), format='%(asctime)s - %(levelname)s - %(message)s')
 
 # Constants
 OUTPUT_FOLDER = "downloaded_videos"
@@ -31,13 +47,290 @@ SCOPES = [
 TOKEN_FILE = 'token.pickle'
 SPREADSHEET_NAME = 'CommuniKitty Video Upload Queue'
 SHEET_NAME = 'Queue'  # Replace with the actual sheet name
+SPREADSHEET_ID = os.environ.get('SPREADSHEET_ID')  # Skips the Drive lookup by name when set
+SPREADSHEET_STATE_FILE = 'spreadsheet_state.json'  # Spreadsheet id and bootstrap state, kept across restarts
+QUEUE_BACKEND = os.environ.get('QUEUE_BACKEND', 'sheets')  # 'sheets' or 'sqlite'
+QUEUE_DB_FILE = os.environ.get('QUEUE_DB_FILE', 'queue.db')
+QUEUE_MIRROR_TO_SHEETS = os.environ.get('QUEUE_MIRROR_TO_SHEETS', '1').lower() in ('1', 'true', 'yes')  # sqlite only
+QUEUE_MIRROR_INTERVAL = float(os.environ.get('QUEUE_MIRROR_INTERVAL', 5))  # Seconds between mirror passes when idle
+CONTENT_INDEX_FILE = os.environ.get('CONTENT_INDEX_FILE', 'content_index.db')  # SHA-256 of uploaded bytes -> Drive URL
+METADATA_CACHE_FILE = os.environ.get('METADATA_CACHE_FILE', 'metadata_cache.db')  # yt-dlp info dicts
+METADATA_CACHE_TTL = float(os.environ.get('METADATA_CACHE_TTL', 3600))  # Seconds; format URLs expire after a few hours
+METADATA_CACHE_MAX_BYTES = int(os.environ.get('METADATA_CACHE_MAX_BYTES', 256 * 1024 * 1024))  # Compressed size budget
+JOB_JOURNAL_FILE = os.environ.get('JOB_JOURNAL_FILE', 'job_journal.db')  # Append-only log of job stage transitions
+JOB_JOURNAL_RETENTION = float(os.environ.get('JOB_JOURNAL_RETENTION', 7 * 24 * 3600))  # Seconds finished jobs are kept
+JOB_JOURNAL_PRUNE_INTERVAL = float(os.environ.get('JOB_JOURNAL_PRUNE_INTERVAL', 3600))  # Seconds between worker prunes in shared mode
+RESUME_JOBS = os.environ.get('RESUME_JOBS', '1').lower() in ('1', 'true', 'yes')  # Resume interrupted jobs on startup
+JOB_RESUME_MAX_ATTEMPTS = int(os.environ.get('JOB_RESUME_MAX_ATTEMPTS', 3))  # Give up on jobs that keep crashing the process
+JOB_QUEUE_MODE = os.environ.get('JOB_QUEUE_MODE', 'local')  # 'local' runs jobs in-process, 'shared' leaves them to worker.py
+JOB_CLAIM_TIMEOUT = float(os.environ.get('JOB_CLAIM_TIMEOUT', 120))  # Seconds without a heartbeat before a claim is taken over
+JOB_HEARTBEAT_INTERVAL = float(os.environ.get('JOB_HEARTBEAT_INTERVAL', 15))  # Seconds between a worker's claim renewals
+SHARED_KEY_RETENTION = float(os.environ.get('SHARED_KEY_RETENTION', 3600))  # Seconds added videos stay in the shared dedup table
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1))  # Seconds an idle worker waits before checking the queue again
+METRICS_PUBLISH_INTERVAL = float(os.environ.get('METRICS_PUBLISH_INTERVAL', 5))  # Seconds between a worker's metrics snapshots
+QUEUE_HEADERS = ['Timestamp', 'Platform', 'Username', 'Source URL', 'Title', 'Description', 'Tags', 'Drive URL', 'Status']
+WORKER_COUNT = int(os.environ.get('WORKER_COUNT', 4))  # Concurrent process_url jobs
+MAX_PENDING_JOBS = int(os.environ.get('MAX_PENDING_JOBS', 100))  # Reject submissions beyond this
+JOB_HISTORY_LIMIT = int(os.environ.get('JOB_HISTORY_LIMIT', 1000))  # Finished jobs kept for polling
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', MAX_PENDING_JOBS))  # URLs per /process/batch call; batches also count toward MAX_PENDING_JOBS
+DOWNLOAD_CONCURRENCY = int(os.environ.get('DOWNLOAD_CONCURRENCY', WORKER_COUNT))  # Jobs downloading at once
+UPLOAD_CONCURRENCY = int(os.environ.get('UPLOAD_CONCURRENCY', WORKER_COUNT))  # Jobs uploading at once
+YDL_POOL_SIZE = int(os.environ.get('YDL_POOL_SIZE', DOWNLOAD_CONCURRENCY))  # Warm YoutubeDL instances per platform
+PLATFORM_LIMITS = {
+    # Max concurrent requests and requests per minute for each platform, overridable with a
+    # PLATFORM_LIMITS JSON env var, e.g. {"Instagram": {"concurrency": 1, "per_minute": 6}}
+    'TikTok': {'concurrency': 2, 'per_minute': 30},
+    'Instagram': {'concurrency': 1, 'per_minute': 12},
+    'YouTube': {'concurrency': 4, 'per_minute': 60}
+}
+for platform_name, limits in json.loads(os.environ.get('PLATFORM_LIMITS', '{}')).items():
+    PLATFORM_LIMITS.setdefault(platform_name, {}).update(limits)
+RATE_LIMIT_BACKOFF_MAX = float(os.environ.get('RATE_LIMIT_BACKOFF_MAX', 600))  # Seconds
+YDL_OPTIONS = {
+    'TikTok': {
+        'format': 'best[ext=mp4]',
+        'outtmpl': os.path.join(OUTPUT_FOLDER, '%(extractor_key)s_%(id)s.%(ext)s'),
+        'quiet': True
+    },
+    'Instagram': {
+        'format': 'best[ext=mp4]',
+        'outtmpl': os.path.join(OUTPUT_FOLDER, '%(extractor_key)s_%(id)s.%(ext)s'),
+        'quiet': True
+    },
+    'YouTube': {
+        'format': 'best',
+        'outtmpl': '%(title)s.%(ext)s',
+        'noplaylist': True,
+        'cookiefile': 'cookies.txt'  # Path to your cookies file
+        # Alternatively, use 'cookiesfrombrowser': 'chrome' for browser cookies
+    }
+}
+FORMAT_POLICIES = {
+    # Download target for each platform, overridable with a FORMAT_POLICIES JSON env var, e.g.
+    # {"YouTube": {"max_height": 720}}. Among formats with both audio and video under the caps,
+    # the highest resolution wins, then the preferred codec, then the smallest file ("smallest": false
+    # picks the largest instead). If no format fits, the YDL_OPTIONS format spec decides as before.
+    'TikTok': {'max_height': 1080, 'max_filesize': 100 * 1024 * 1024, 'codecs': ['h264', 'h265'], 'ext': 'mp4',
+               'smallest': True},
+    'Instagram': {'max_height': 1080, 'max_filesize': 100 * 1024 * 1024, 'codecs': ['h264'], 'ext': 'mp4',
+                  'smallest': True},
+    'YouTube': {'max_height': 1080, 'max_filesize': 500 * 1024 * 1024, 'codecs': ['h264', 'vp9', 'av1'],
+                'smallest': True}
+}
+for platform_name, policy in json.loads(os.environ.get('FORMAT_POLICIES', '{}')).items():
+    FORMAT_POLICIES.setdefault(platform_name, {}).update(policy)
+URL_INDEX_TTL = float(os.environ.get('URL_INDEX_TTL', 60))  # Seconds before the dedup index re-reads new rows
+QUEUE_SNAPSHOT_TTL = float(os.environ.get('QUEUE_SNAPSHOT_TTL', 10))  # Seconds /queue serves its snapshot unchecked
+QUEUE_PAGE_SIZE = 100  # Rows per /queue page unless ?limit= says otherwise
+QUEUE_PAGE_MAX = 1000  # Largest ?limit= accepted
+TRACKING_PARAMS = {'si', 'feature', 'pp', 'igsh', 'igshid', 'fbclid', 'gclid', 'is_from_webapp',
+                   'sender_device', 'sender_web_id', 'share_app_id', 'share_link_id', '_r', '_t', 'img_index'}
+CREDENTIALS_REFRESH_MARGIN = timedelta(seconds=int(os.environ.get('CREDENTIALS_REFRESH_MARGIN', 300)))
+HTTP_TIMEOUT = int(os.environ.get('HTTP_TIMEOUT', 120))
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))  # Must be a multiple of 256 KiB
+UPLOAD_MAX_RETRIES = int(os.environ.get('UPLOAD_MAX_RETRIES', 8))
+UPLOAD_SESSIONS_FILE = 'upload_sessions.json'  # Where older versions kept session URIs; imported into the journal once
+UPLOAD_SESSION_MAX_AGE = 6 * 24 * 3600  # Drive expires resumable sessions after a week
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+STREAM_UPLOADS = os.environ.get('STREAM_UPLOADS', '').lower() in ('1', 'true', 'yes')  # Pipe downloads straight to Drive
+STREAM_READ_SIZE = 1024 * 1024
+STREAM_BUFFER_BLOCKS = int(os.environ.get('STREAM_BUFFER_BLOCKS', 16))  # Bounded in-memory buffer, in STREAM_READ_SIZE blocks
+SHEET_BATCH_SIZE = int(os.environ.get('SHEET_BATCH_SIZE', 20))  # Flush queued rows once this many are pending
+SHEET_FLUSH_INTERVAL = float(os.environ.get('SHEET_FLUSH_INTERVAL_MS', 2000)) / 1000  # ...or once the oldest has waited this long
+SHEET_APPEND_MAX_RETRIES = int(os.environ.get('SHEET_APPEND_MAX_RETRIES', 6))  # 429/5xx retries, about two minutes of backoff
+SHEET_APPEND_TIMEOUT = 300  # Seconds a job waits for its row to be written, retries included
+
+# Metrics: counters and per-stage duration histograms, rendered in Prometheus text format at /metrics
+
+METRICS_PREFIX = 'addvideo'
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+THROUGHPUT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)  # Mbit/s
+metric_counters = {}  # (name, labels) -> value
+metric_histograms = {}  # (name, labels) -> [bucket counts..., count, sum]
+metric_buckets = {}  # name -> bucket bounds, for histograms not using STAGE_BUCKETS
+metrics_lock = threading.Lock()
+
+def inc_counter(name, value=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with metrics_lock:
+        metric_counters[key] = metric_counters.get(key, 0) + value
+
+def observe_duration(name, seconds, **labels):
+    observe_histogram(name, seconds, STAGE_BUCKETS, **labels)
+
+def observe_histogram(name, value, buckets, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with metrics_lock:
+        metric_buckets.setdefault(name, buckets)
+        histogram = metric_histograms.setdefault(key, [0] * len(buckets) + [0, 0.0])
+        for index, bound in enumerate(buckets):
+            if value <= bound:
+                histogram[index] += 1
+        histogram[-2] += 1
+        histogram[-1] += value
+
+@contextmanager
+def stage_timer(stage, **labels):
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_duration('stage_duration_seconds', time.perf_counter() - started_at, stage=stage, **labels)
+
+class CountingHttpRequest(HttpRequest):
+    # Counts every Google API round trip (execute and each resumable chunk) by API method
+    def execute(self, *args, **kwargs):
+        inc_counter('google_api_calls_total', method=self.methodId or 'unknown')
+        return super().execute(*args, **kwargs)
+
+    def next_chunk(self, *args, **kwargs):
+        inc_counter('google_api_calls_total', method=self.methodId or 'unknown')
+        return super().next_chunk(*args, **kwargs)
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+def snapshot_metrics():
+    with metrics_lock:
+        return (dict(metric_counters), {key: list(histogram) for key, histogram in metric_histograms.items()},
+                dict(metric_buckets))
+
+def render_metrics(gauges, snapshot=None):
+    lines = []
+    counters, histograms, buckets = snapshot or snapshot_metrics()
+    counters = sorted(counters.items())
+    histograms = sorted(histograms.items())
+    seen = set()
+    for (name, labels), value in counters:
+        if name not in seen:
+            lines.append(f"# TYPE {METRICS_PREFIX}_{name} counter")
+            seen.add(name)
+        lines.append(f"{METRICS_PREFIX}_{name}{format_labels(labels)} {value}")
+    for (name, labels), histogram in histograms:
+        if name not in seen:
+            lines.append(f"# TYPE {METRICS_PREFIX}_{name} histogram")
+            seen.add(name)
+        for bound, count in zip(buckets.get(name, STAGE_BUCKETS), histogram):
+            lines.append(f"{METRICS_PREFIX}_{name}_bucket{format_labels(labels + (('le', bound),))} {count}")
+        lines.append(f"{METRICS_PREFIX}_{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {histogram[-2]}")
+        lines.append(f"{METRICS_PREFIX}_{name}_count{format_labels(labels)} {histogram[-2]}")
+        lines.append(f"{METRICS_PREFIX}_{name}_sum{format_labels(labels)} {round(histogram[-1], 6)}")
+    for name, samples in gauges.items():
+        lines.append(f"# TYPE {METRICS_PREFIX}_{name} gauge")
+        for labels, value in samples:
+            lines.append(f"{METRICS_PREFIX}_{name}{format_labels(tuple(sorted(labels.items())))} {value}")
+    return '\n'.join(lines) + '\n'
+
+# Google API client provider: credentials are loaded once per process and each thread
+# builds its own services on a private httplib2 transport, since httplib2 is not thread-safe.
+# Nothing here runs at import time; the first call that needs Google does the work.
+google_credentials = None
+credentials_lock = threading.Lock()
+service_context = threading.local()
+services_factory = None  # Optional callable returning (sheets_service, drive_service), e.g. local stubs
+services_generation = 0
+
+def load_credentials():
+    logging.debug("Loading Google credentials.")
+    creds = None
+    if os.path.exists(TOKEN_FILE):
+        with open(TOKEN_FILE, 'rb') as token:
+            creds = pickle.load(token)
+            logging.debug("Loaded credentials from token file.")
+
+    if not creds or not creds.valid:
+        logging.debug("Credentials are not valid, refreshing or obtaining new credentials.")
+        if creds and creds.expired and creds.refresh_token:
+            creds.refresh(Request())
+            logging.debug("Credentials refreshed.")
+        else:
+            credentials_json = os.getenv('GOOGLE_CREDENTIALS_JSON')
+            if credentials_json:
+                with open('credentials.json', 'w') as creds_file:
+                    creds_file.write(credentials_json)
+                logging.debug("Credentials JSON saved to file.")
+                flow = InstalledAppFlow.from_client_config(json.loads(credentials_json), SCOPES)
+            elif os.path.exists('credentials.json'):
+                flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
+            else:
+                logging.error("Missing Google API credentials.")
+                raise Exception("Missing Google API credentials.")
+            creds = flow.run_local_server(port=0)
+            logging.debug("Obtained new credentials via local server.")
+        save_credentials(creds)
+    return creds
+
+def save_credentials(creds):
+    with open(TOKEN_FILE, 'wb') as token:
+        pickle.dump(creds, token)
+        logging.debug("Credentials saved to token file.")
+
+def get_credentials():
+    # Returns the shared credentials, refreshing them in place shortly before they expire
+    global google_credentials
+    with credentials_lock:
+        if google_credentials is None:
+            google_credentials = load_credentials()
+        creds = google_credentials
+        now = datetime.now(timezone.utc).replace(tzinfo=None)  # google-auth keeps expiry as naive UTC
+        if creds.refresh_token and (not creds.valid or (creds.expiry and creds.expiry - now < CREDENTIALS_REFRESH_MARGIN)):
+            logging.debug("Refreshing Google credentials before expiry.")
+            creds.refresh(Request())
+            save_credentials(creds)
+        return creds
+
+def set_services_factory(factory):
+    # Swaps the Google backend for every thread, e.g. to run offline against stub services
+    global services_factory, services_generation
+    with credentials_lock:
+        services_factory = factory
+        services_generation += 1
+
+def get_services():
+    # Returns this thread's (sheets_service, drive_service), building them on first use
+    if services_factory is not None:
+        if getattr(service_context, 'generation', None) != services_generation:
+            service_context.services = services_factory()
+            service_context.http = None
+            service_context.credentials = None
+            service_context.generation = services_generation
+        return service_context.services
+
+    creds = get_credentials()
+    services = getattr(service_context, 'services', None)
+    if services is None or getattr(service_context, 'credentials', None) is not creds \
+            or getattr(service_context, 'generation', None) != services_generation:
+        http = AuthorizedHttp(creds, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+        service_context.http = http
+        services = (
+            build('sheets', 'v4', http=http, cache_discovery=False, requestBuilder=CountingHttpRequest),
+            build('drive', 'v3', http=http, cache_discovery=False, requestBuilder=CountingHttpRequest)
+        )
+        service_context.services = services
+        service_context.credentials = creds
+        service_context.generation = services_generation
+        logging.debug("Google services initialized for thread %s.", threading.current_thread().name)
+    return services
+
+def get_sheets_service():
+    return get_services()[0]
+
+def get_authorized_http():
+    get_services()
+    return service_context.http
+
+def get_drive_service():
+    return get_services()[1]
 
 # Function to retrieve the SPREADSHEET_ID using the spreadsheet name
 def get_spreadsheet_id_by_name(spreadsheet_name):
-    logging.debug(f"Searching for spreadsheet with name: {spreadsheet_name}")
+    logging.debug("Searching for spreadsheet with name: %s", spreadsheet_name)
     try:
         # Search for the spreadsheet by name
-        results = drive_service.files().list(
+        results = get_drive_service().files().list(
             q=f"name='{spreadsheet_name}' and mimeType='application/vnd.google-apps.spreadsheet'",
             spaces='drive',
             fields='files(id, name)').execute()
@@ -49,34 +342,54 @@ def get_spreadsheet_id_by_name(spreadsheet_name):
         else:
             # Return the first matching spreadsheet ID
             spreadsheet_id = items[0]['id']
-            logging.debug(f"Spreadsheet ID found: {spreadsheet_id}")
+            logging.debug("Spreadsheet ID found: %s", spreadsheet_id)
             return spreadsheet_id
     except Exception as e:
-        logging.error(f"Error retrieving spreadsheet ID: {str(e)}")
+        logging.error("Error retrieving spreadsheet ID: %s", e)
         return None
 
-# Initialize Google Drive and Sheets API clients
-creds = None
-if os.path.exists(TOKEN_FILE):
-    with open(TOKEN_FILE, 'rb') as token:
-        creds = pickle.load(token)
+spreadsheet_id_lock = threading.RLock()
 
-if not creds or not creds.valid:
-    if creds and creds.expired and creds.refresh_token:
-        creds.refresh(Request())
-    else:
-        flow = InstalledAppFlow.from_client_secrets_file(
-            'credentials.json', SCOPES)
-        creds = flow.run_local_server(port=0)
-    # Save the credentials for the next run
-    with open(TOKEN_FILE, 'wb') as token:
-        pickle.dump(creds, token)
+def get_spreadsheet_id():
+    # Bootstraps the spreadsheet on first use and caches it; a failed bootstrap is retried next call
+    with spreadsheet_id_lock:
+        if SPREADSHEET_ID:
+            return SPREADSHEET_ID
+        try:
+            return get_or_create_spreadsheet()
+        except Exception as e:
+            logging.error("Error retrieving spreadsheet ID: %s", e)
+            return None
 
-drive_service = build('drive', 'v3', credentials=creds)
-sheets_service = build('sheets', 'v4', credentials=creds)
+def load_spreadsheet_state():
+    if not os.path.exists(SPREADSHEET_STATE_FILE):
+        return {}
+    try:
+        with open(SPREADSHEET_STATE_FILE, 'r') as state_file:
+            state = json.load(state_file)
+        return state if state.get('name') == SPREADSHEET_NAME else {}
+    except (OSError, ValueError) as e:
+        logging.error("Error reading spreadsheet state: %s", e)
+        return {}
+
+def save_spreadsheet_state(state):
+    tmp_file = f"{SPREADSHEET_STATE_FILE}.tmp"
+    with open(tmp_file, 'w') as state_file:
+        json.dump(state, state_file)
+    os.replace(tmp_file, SPREADSHEET_STATE_FILE)
 
-# Use this function to get the SPREADSHEET_ID
-SPREADSHEET_ID = get_spreadsheet_id_by_name(SPREADSHEET_NAME)
+def invalidate_spreadsheet(spreadsheet_id):
+    # Called when a Sheets call reports the spreadsheet missing; the next call bootstraps again
+    global SPREADSHEET_ID
+    with spreadsheet_id_lock:
+        if SPREADSHEET_ID == spreadsheet_id:
+            SPREADSHEET_ID = None
+        if load_spreadsheet_state().get('spreadsheet_id') == spreadsheet_id:
+            save_spreadsheet_state({})
+    logging.warning("Spreadsheet %s not found, it will be bootstrapped again.", spreadsheet_id)
+
+def is_not_found_error(error):
+    return isinstance(error, HttpError) and error.resp.status == 404
 
 # Ensure output directory exists
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
@@ -84,66 +397,632 @@ os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 # Initialize Flask app
 app = Flask(__name__)
 
-# Google Services
+# Job queue: /process submits to a bounded worker pool and clients poll /jobs/<id>
+job_executor = ThreadPoolExecutor(max_workers=WORKER_COUNT, thread_name_prefix='job-worker')
+jobs = OrderedDict()
+jobs_lock = threading.Lock()
+job_context = threading.local()
+FINISHED_JOB_STATUSES = ('done', 'failed', 'skipped')
+job_status_listeners = []  # Callables (job_id, status) run after every transition, e.g. the ASGI long-poll
+batches = OrderedDict()  # batch_id -> [(url, job_id)]
 
-def get_google_services():
-    logging.debug("Attempting to get Google services.")
-    creds = None
-    if os.path.exists(TOKEN_FILE):
-        with open(TOKEN_FILE, 'rb') as token:
-            creds = pickle.load(token)
-            logging.debug("Loaded credentials from token file.")
+# Stage limits shared by all jobs, so downloads and uploads can be tuned independently
+download_slots = threading.BoundedSemaphore(DOWNLOAD_CONCURRENCY)
+upload_slots = threading.BoundedSemaphore(UPLOAD_CONCURRENCY)
 
-    if not creds or not creds.valid:
-        logging.debug("Credentials are not valid, refreshing or obtaining new credentials.")
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-            logging.debug("Credentials refreshed.")
+# Jobs
+
+def create_job(url, job_id=None):
+    # job_id is only given when resuming a journaled job after a restart
+    job_id = job_id or uuid.uuid4().hex
+    job = {
+        'id': job_id,
+        'url': url,
+        'status': 'queued',
+        'error': None,
+        'created_at': time.time(),
+        'timings': {'queued': 0.0}
+    }
+    with jobs_lock:
+        jobs[job_id] = job
+        prune_jobs()
+    logging.debug("Created job %s for URL: %s", job_id, url)
+    return job
+
+def prune_jobs():
+    # Drop the oldest finished jobs once the history limit is reached (caller holds jobs_lock)
+    finished = [job_id for job_id, job in jobs.items() if job['status'] in FINISHED_JOB_STATUSES]
+    while len(jobs) > JOB_HISTORY_LIMIT and finished:
+        jobs.pop(finished.pop(0), None)
+
+def count_pending_jobs():
+    if JOB_QUEUE_MODE == 'shared':
+        return count_queued_jobs()
+    with jobs_lock:
+        return sum(1 for job in jobs.values() if job['status'] not in FINISHED_JOB_STATUSES)
+
+def set_job_status(status, error=None):
+    # Records a stage transition for the job running on the current worker thread
+    job_id = getattr(job_context, 'job_id', None)
+    if not job_id:
+        return
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if not job:
+            return
+        job['status'] = status
+        job['timings'][status] = round(time.time() - job['created_at'], 3)
+        if error:
+            job['error'] = error
+        row = job.get('row')
+    record_job_stage(status, job_id, error=error, row=row)
+    for listener in job_status_listeners:
+        listener(job_id, status)
+    logging.debug("Job %s is now %s", job_id, status)
+
+def set_job_fields(**fields):
+    job_id = getattr(job_context, 'job_id', None)
+    if not job_id:
+        return
+    with jobs_lock:
+        if job_id in jobs:
+            jobs[job_id].update(fields)
+
+def record_job_row(job_id, row):
+    # For a row that reached the sheet after add_row returned, possibly from another process
+    with jobs_lock:
+        if job_id in jobs:
+            jobs[job_id]['row'] = row
+    record_job_stage('sheet_row', job_id, row=row)
+
+def get_job(job_id):
+    if JOB_QUEUE_MODE == 'shared':
+        # Jobs run in worker processes, so the journal is the only place their state is visible
+        job = load_journaled_job(job_id)
+        if not job:
+            return None
+    else:
+        with jobs_lock:
+            job = jobs.get(job_id)
+            if not job:
+                return None
+            job = dict(job, timings=dict(job['timings']))
+    end = next((job['timings'][status] for status in FINISHED_JOB_STATUSES if status in job['timings']), None)
+    job['elapsed'] = end if end is not None else round(time.time() - job['created_at'], 3)
+    return job
+
+def get_current_job_status():
+    job_id = getattr(job_context, 'job_id', None)
+    with jobs_lock:
+        job = jobs.get(job_id) if job_id else None
+        return job['status'] if job else None
+
+def run_job(job_id, url, checkpoint=None, platform_lease=None):
+    # platform_lease is the limiter whose slot and token the dispatcher reserved for this job
+    job_context.job_id = job_id
+    job_context.platform_lease = platform_lease
+    platform = get_url_platform(url) or 'other'
+    try:
+        video_path, info = process_url(url, checkpoint)
+        status = get_current_job_status()
+        if status == 'skipped':
+            pass
+        elif not video_path or not info:
+            inc_counter('job_errors_total', platform=platform, stage=status)
+            set_job_status('failed', error='Failed to download video or extract metadata.')
         else:
-            credentials_json = os.getenv('GOOGLE_CREDENTIALS_JSON')
-            if credentials_json:
-                with open('credentials.json', 'w') as creds_file:
-                    creds_file.write(credentials_json)
-                logging.debug("Credentials JSON saved to file.")
-                credentials_data = json.loads(credentials_json)
-                flow = InstalledAppFlow.from_client_config(credentials_data, SCOPES)
-                creds = flow.run_local_server(port=0)
-                logging.debug("Obtained new credentials via local server.")
-            else:
-                logging.error("Missing Google API credentials.")
-                raise Exception("Missing Google API credentials.")
+            set_job_status('done')
+    except Exception as e:
+        logging.error("Job %s failed: %s", job_id, e)
+        inc_counter('job_errors_total', platform=platform, stage=get_current_job_status())
+        set_job_status('failed', error=str(e))
+    finally:
+        inc_counter('jobs_total', platform=platform, status=get_current_job_status())
+        release_platform_lease()
+        job_context.job_id = None
+        job_context.download_hasher = None
+
+def submit_job(url, executor=None):
+    if JOB_QUEUE_MODE == 'shared' and executor is None:
+        return {'id': enqueue_job(url), 'url': url, 'status': 'queued'}
+    job = create_job(url)
+    record_job_stage('queued', job['id'], url=url, owner=get_job_owner())
+    dispatch_job(job['id'], url, executor=executor)
+    return job
+
+def set_stage_concurrency(download_concurrency, upload_concurrency):
+    # Only safe before any jobs are running
+    global download_slots, upload_slots
+    download_slots = threading.BoundedSemaphore(download_concurrency)
+    upload_slots = threading.BoundedSemaphore(upload_concurrency)
+
+def submit_batch(urls, executor=None):
+    batch_id = uuid.uuid4().hex
+    entries = [(url, submit_job(url, executor)['id']) for url in urls]
+    with jobs_lock:
+        batches[batch_id] = entries
+        while len(batches) > JOB_HISTORY_LIMIT:
+            batches.popitem(last=False)
+    logging.info("Submitted batch %s with %s URLs", batch_id, len(entries))
+    return batch_id, entries
+
+def get_batch_summary(batch_id):
+    with jobs_lock:
+        entries = batches.get(batch_id)
+    if entries is None:
+        return None
+    results = []
+    counts = {}
+    for url, job_id in entries:
+        job = get_job(job_id) or {'id': job_id, 'status': 'unknown'}
+        counts[job['status']] = counts.get(job['status'], 0) + 1
+        results.append({
+            'url': url,
+            'job_id': job_id,
+            'status': job['status'],
+            'error': job.get('error'),
+            'row': job.get('row'),
+            'elapsed': job.get('elapsed')
+        })
+    finished = all(result['status'] in FINISHED_JOB_STATUSES + ('unknown',) for result in results)
+    return {'batch_id': batch_id, 'total': len(results), 'finished': finished, 'counts': counts, 'results': results}
+
+def parse_url_list(text):
+    # Accepts JSONL ({"url": ...} objects or JSON strings per line) or plain URLs, one per line
+    urls = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line[0] in '{"':
+            entry = json.loads(line)
+            url = entry.get('url') if isinstance(entry, dict) else entry
+        else:
+            url = line
+        if url:
+            urls.append(url)
+    return urls
+
+# Job Journal: every stage transition is appended to a local SQLite log, and the "downloaded"
+# and "uploaded" checkpoints carry what is needed to carry on from there, so after a restart
+# an interrupted job resumes from its last checkpoint instead of starting over
+
+job_journal_context = threading.local()
+JOURNAL_CHECKPOINTS = ('downloaded', 'uploaded')
+JOURNAL_METADATA_FIELDS = ('id', 'extractor_key', 'webpage_url', 'source_url', 'title', 'uploader', 'uploader_id',
+                           'channel', 'description', 'tags', 'ext', 'content_sha256')
+
+def add_missing_columns(connection, table, columns):
+    # Migrates a table created by an older version; worker processes opening the database at the
+    # same time may race to add the same column, and the loser's ALTER TABLE fails harmlessly
+    existing = {row[1] for row in connection.execute(f'PRAGMA table_info({table})')}
+    for column, column_type in columns:
+        if column in existing:
+            continue
+        try:
+            with connection:
+                connection.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+        except sqlite3.OperationalError as e:
+            if 'duplicate column' not in str(e):
+                raise
+
+def get_job_journal():
+    connection = getattr(job_journal_context, 'connection', None)
+    if connection is None:
+        connection = sqlite3.connect(JOB_JOURNAL_FILE, timeout=30)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=FULL')
+        connection.executescript('''
+            CREATE TABLE IF NOT EXISTS journal (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT, stage TEXT, url TEXT, data TEXT,
+                recorded_at REAL);
+            CREATE INDEX IF NOT EXISTS journal_job_id ON journal (job_id);
+            CREATE TABLE IF NOT EXISTS job_queue (
+                job_id TEXT PRIMARY KEY, url TEXT, enqueued_at REAL, claimed_by TEXT, claim_token TEXT,
+                heartbeat_at REAL);
+            CREATE INDEX IF NOT EXISTS job_queue_enqueued_at ON job_queue (enqueued_at);
+            CREATE TABLE IF NOT EXISTS shared_keys (
+                key TEXT PRIMARY KEY, job_id TEXT, state TEXT, updated_at REAL);
+            CREATE TABLE IF NOT EXISTS platform_state (
+                platform TEXT PRIMARY KEY, tokens REAL, refilled_at REAL, backoff REAL, backoff_until REAL);
+            CREATE TABLE IF NOT EXISTS upload_sessions (session_key TEXT PRIMARY KEY, uri TEXT, created_at REAL);
+            CREATE TABLE IF NOT EXISTS process_metrics (owner TEXT PRIMARY KEY, data TEXT, updated_at REAL);
+            CREATE TABLE IF NOT EXISTS platform_leases (
+                platform TEXT, lease_id TEXT, owner TEXT, acquired_at REAL, PRIMARY KEY (platform, lease_id));
+        ''')
+        add_missing_columns(connection, 'job_queue', [('platform', 'TEXT')])
+        job_journal_context.connection = connection
+    return connection
+
+def record_job_stage(stage, job_id=None, url=None, **data):
+    # Best effort: a journal write failure only costs the ability to resume this job
+    job_id = job_id or getattr(job_context, 'job_id', None)
+    if not job_id:
+        return
+    data = {key: value for key, value in data.items() if value is not None}
+    try:
+        connection = get_job_journal()
+        with connection:
+            connection.execute('INSERT INTO journal (job_id, stage, url, data, recorded_at) VALUES (?, ?, ?, ?, ?)',
+                               (job_id, stage, url, json.dumps(data, default=str) if data else None, time.time()))
+    except sqlite3.Error as e:
+        logging.error("Error recording stage %s for job %s: %s", stage, job_id, e)
+
+def journal_metadata(info):
+    # Only the fields needed to write the queue row, not the full yt-dlp info dict
+    return {key: info[key] for key in JOURNAL_METADATA_FIELDS if key in info}
+
+process_owner = None
+
+def get_job_owner():
+    # Identifies the process running a job; the boot id tells a live pid from one reused after a
+    # reboot, and the token tells this process from an earlier one that had the same pid (pid 1
+    # in a container). Rebuilt after a fork, since the child has its own pid.
+    global process_owner
+    if process_owner is None or process_owner['pid'] != os.getpid():
+        try:
+            with open('/proc/sys/kernel/random/boot_id') as boot_id_file:
+                boot_id = boot_id_file.read().strip()
+        except OSError:
+            boot_id = ''
+        process_owner = {'pid': os.getpid(), 'boot_id': boot_id, 'token': uuid.uuid4().hex}
+    return process_owner
+
+def is_job_owner_alive(owner):
+    # Entries written before owners were recorded count as orphaned
+    if not owner or owner.get('boot_id') != get_job_owner()['boot_id']:
+        return False
+    if owner.get('pid') == os.getpid():
+        return owner.get('token') == get_job_owner()['token']
+    try:
+        os.kill(owner['pid'], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def load_interrupted_jobs():
+    # Jobs with no finished stage whose owning process is gone, oldest first, with their latest
+    # checkpoint and resume count. A CLI batch or another server sharing the journal file keeps
+    # its jobs while it runs.
+    connection = get_job_journal()
+    finished = ', '.join('?' for _ in FINISHED_JOB_STATUSES)
+    rows = connection.execute(
+        f'SELECT job_id, MAX(url), SUM(stage = ?) FROM journal GROUP BY job_id '
+        f'HAVING SUM(stage IN ({finished})) = 0 AND MAX(url) IS NOT NULL ORDER BY MIN(id)',
+        ('resumed',) + FINISHED_JOB_STATUSES).fetchall()
+    interrupted = []
+    for job_id, url, attempts in rows:
+        owner = load_job_owner(job_id)
+        if is_job_owner_alive(owner):
+            logging.debug("Job %s still belongs to running process %s, not resuming", job_id, owner['pid'])
+            continue
+        interrupted.append((job_id, url, attempts, load_checkpoint(job_id)))
+    return interrupted
+
+def load_job_owner(job_id):
+    row = get_job_journal().execute(
+        "SELECT data FROM journal WHERE job_id = ? AND stage IN ('queued', 'resumed') ORDER BY id DESC LIMIT 1",
+        (job_id,)).fetchone()
+    return json.loads(row[0]).get('owner') if row and row[0] else None
+
+def load_checkpoint(job_id):
+    row = get_job_journal().execute(
+        'SELECT stage, data FROM journal WHERE job_id = ? AND stage IN (?, ?) ORDER BY id DESC LIMIT 1',
+        (job_id,) + JOURNAL_CHECKPOINTS).fetchone()
+    return {'stage': row[0], **json.loads(row[1])} if row else None
+
+def load_finished_jobs(job_ids):
+    # {job_id: finished status} for the given jobs that have finished, in one query per 500 ids
+    finished_jobs = {}
+    connection = get_job_journal()
+    job_ids = list(job_ids)
+    for start in range(0, len(job_ids), 500):
+        chunk = job_ids[start:start + 500]
+        rows = connection.execute(
+            f"SELECT job_id, stage FROM journal WHERE job_id IN ({', '.join('?' for _ in chunk)}) "
+            f"AND stage IN ({', '.join('?' for _ in FINISHED_JOB_STATUSES)})",
+            tuple(chunk) + FINISHED_JOB_STATUSES).fetchall()
+        finished_jobs.update(rows)
+    return finished_jobs
+
+def load_journaled_job(job_id):
+    # Rebuilds the get_job view of a job from its journal entries
+    rows = get_job_journal().execute(
+        'SELECT stage, url, data, recorded_at FROM journal WHERE job_id = ? ORDER BY id', (job_id,)).fetchall()
+    if not rows:
+        return None
+    job = {'id': job_id, 'url': None, 'status': 'queued', 'error': None, 'created_at': rows[0][3], 'timings': {}}
+    for stage, url, data, recorded_at in rows:
+        data = json.loads(data) if data else {}
+        job['url'] = job['url'] or url
+        if 'row' in data:
+            job['row'] = data['row']
+        if stage in JOURNAL_CHECKPOINTS or stage in ('claimed', 'resumed', 'sheet_row'):
+            continue
+        job['status'] = stage
+        job['timings'][stage] = round(recorded_at - job['created_at'], 3)
+        job['error'] = data.get('error', job['error'])
+    return job
 
-        with open(TOKEN_FILE, 'wb') as token:
-            pickle.dump(creds, token)
-            logging.debug("Credentials saved to token file.")
+def prune_job_journal():
+    connection = get_job_journal()
+    finished = ', '.join('?' for _ in FINISHED_JOB_STATUSES)
+    with connection:
+        connection.execute(
+            f'DELETE FROM journal WHERE job_id IN (SELECT job_id FROM journal WHERE stage IN ({finished}) '
+            f'AND recorded_at < ?)', FINISHED_JOB_STATUSES + (time.time() - JOB_JOURNAL_RETENTION,))
+        # Snapshots of workers that stopped publishing; live workers refresh theirs every few seconds
+        connection.execute('DELETE FROM process_metrics WHERE updated_at < ?', (time.time() - JOB_JOURNAL_RETENTION,))
+        connection.execute('DELETE FROM upload_sessions WHERE created_at < ?', (time.time() - UPLOAD_SESSION_MAX_AGE,))
 
-    sheets_service = build('sheets', 'v4', credentials=creds)
-    drive_service = build('drive', 'v3', credentials=creds)
-    logging.debug("Google services initialized.")
-    return sheets_service, drive_service
+def resume_jobs(executor=None):
+    # Called once at startup: resubmits every job the previous process left unfinished.
+    # In shared mode the workers take over stale claims from the queue instead.
+    if JOB_QUEUE_MODE == 'shared':
+        return []
+    try:
+        prune_job_journal()
+        interrupted = load_interrupted_jobs()
+    except sqlite3.Error as e:
+        logging.error("Error reading job journal: %s", e)
+        return []
+    resumed = []
+    for job_id, url, attempts, checkpoint in interrupted:
+        if attempts >= JOB_RESUME_MAX_ATTEMPTS:
+            logging.warning("Job %s was interrupted %s times, giving up: %s", job_id, attempts, url)
+            record_job_stage('failed', job_id, error='Interrupted too many times')
+            continue
+        create_job(url, job_id)
+        record_job_stage('resumed', job_id, checkpoint=checkpoint['stage'] if checkpoint else None, owner=get_job_owner())
+        dispatch_job(job_id, url, checkpoint, executor)
+        resumed.append(job_id)
+        logging.info("Resuming job %s from %s: %s", job_id, checkpoint['stage'] if checkpoint else 'the start', url)
+    return resumed
+
+# Shared Job Queue: in shared mode the web process only enqueues, and worker.py processes
+# claim jobs from a table next to the journal, renewing a heartbeat while they run them
+
+def enqueue_job(url):
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    connection = get_job_journal()
+    with connection:
+        connection.execute('INSERT INTO journal (job_id, stage, url, data, recorded_at) VALUES (?, ?, ?, ?, ?)',
+                           (job_id, 'queued', url, None, now))
+        connection.execute('INSERT INTO job_queue (job_id, url, platform, enqueued_at) VALUES (?, ?, ?, ?)',
+                           (job_id, url, get_url_platform(url), now))
+    logging.debug("Enqueued job %s for URL: %s", job_id, url)
+    return job_id
+
+def count_queued_jobs():
+    return get_job_journal().execute('SELECT COUNT(*) FROM job_queue').fetchone()[0]
+
+def claim_job(worker_id):
+    # Takes the oldest unclaimed job, or one whose worker stopped sending heartbeats, skipping
+    # platforms with no free slot or token. Checking the shared platform limits, taking the
+    # job's slot and token and claiming the row happen in one write transaction, so two
+    # workers can neither claim the same row nor spend the same token.
+    # Returns (job_id, url, attempts, checkpoint, platform_lease) or None.
+    now = time.time()
+    connection = get_job_journal()
+    with connection:
+        connection.execute('BEGIN IMMEDIATE')
+        blocked_platforms = [platform for platform in PLATFORM_LIMITS
+                             if not get_platform_limiter(platform).is_ready_at(connection, now)]
+        platform_filter = ''
+        if blocked_platforms:
+            platform_filter = f" AND (platform IS NULL OR platform NOT IN ({', '.join('?' for _ in blocked_platforms)}))"
+        row = connection.execute(
+            f'SELECT job_id, url FROM job_queue WHERE (claimed_by IS NULL OR heartbeat_at < ?){platform_filter} '
+            'ORDER BY enqueued_at LIMIT 1', (now - JOB_CLAIM_TIMEOUT,) + tuple(blocked_platforms)).fetchone()
+        if not row:
+            return None
+        job_id, url = row
+        attempts = connection.execute('SELECT COUNT(*) FROM journal WHERE job_id = ? AND stage = ?',
+                                      (job_id, 'claimed')).fetchone()[0]
+        checkpoint = load_checkpoint(job_id) if attempts else None
+        # Like dispatch_job: a job still needing its platform only runs once it holds a slot and token
+        platform = None if checkpoint or attempts >= JOB_RESUME_MAX_ATTEMPTS else get_url_platform(url)
+        platform_lease = get_platform_limiter(platform) if platform else None
+        if platform_lease and not platform_lease.take_lease(connection, job_id, now):
+            return None
+        connection.execute('UPDATE job_queue SET claimed_by = ?, claim_token = ?, heartbeat_at = ? WHERE job_id = ?',
+                           (worker_id, uuid.uuid4().hex, now, job_id))
+    return job_id, url, attempts, checkpoint, platform_lease
+
+def renew_job_claims(worker_id):
+    connection = get_job_journal()
+    with connection:
+        connection.execute('UPDATE job_queue SET heartbeat_at = ? WHERE claimed_by = ?', (time.time(), worker_id))
+
+def complete_job(job_id):
+    connection = get_job_journal()
+    with connection:
+        connection.execute('DELETE FROM job_queue WHERE job_id = ?', (job_id,))
+        connection.execute("DELETE FROM shared_keys WHERE job_id = ? AND state = 'in_flight'", (job_id,))
+
+def run_claimed_job(job_id, url, checkpoint, platform_lease):
+    try:
+        create_job(url, job_id)
+        if checkpoint:
+            logging.info("Resuming job %s from %s: %s", job_id, checkpoint['stage'], url)
+        run_job(job_id, url, checkpoint, platform_lease)
+    finally:
+        complete_job(job_id)
+        with jobs_lock:
+            jobs.pop(job_id, None)
+
+def run_worker(threads=WORKER_COUNT, stop_event=None):
+    # Worker process main loop: keeps up to `threads` claimed jobs running until stop_event is set
+    worker_id = f"{os.uname().nodename}:{os.getpid()}"
+    stop_event = stop_event or threading.Event()
+    active = threading.BoundedSemaphore(threads)
+    logging.info("Worker %s started with %s threads", worker_id, threads)
+
+    def send_heartbeats():
+        # Also prunes the journal, which resume_jobs does at startup in local mode
+        pruned_at = 0.0
+        while True:
+            if time.time() - pruned_at >= JOB_JOURNAL_PRUNE_INTERVAL:
+                try:
+                    prune_job_journal()
+                except sqlite3.Error as e:
+                    logging.error("Error pruning job journal: %s", e)
+                pruned_at = time.time()
+            if stop_event.wait(JOB_HEARTBEAT_INTERVAL):
+                return
+            try:
+                renew_job_claims(worker_id)
+            except sqlite3.Error as e:
+                logging.error("Error renewing job claims: %s", e)
+
+    def send_metrics():
+        while not stop_event.wait(METRICS_PUBLISH_INTERVAL):
+            try:
+                publish_process_metrics()
+            except sqlite3.Error as e:
+                logging.error("Error publishing metrics: %s", e)
+
+    threading.Thread(target=send_heartbeats, name='job-heartbeat', daemon=True).start()
+    threading.Thread(target=send_metrics, name='metrics-publisher', daemon=True).start()
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='job-worker') as executor:
+        while not stop_event.is_set():
+            if not active.acquire(timeout=JOB_POLL_INTERVAL):
+                continue
+            try:
+                claimed = claim_job(worker_id)
+            except sqlite3.Error as e:
+                logging.error("Error claiming job: %s", e)
+                claimed = None
+            if not claimed:
+                active.release()
+                stop_event.wait(JOB_POLL_INTERVAL)
+                continue
+            job_id, url, attempts, checkpoint, platform_lease = claimed
+            if attempts >= JOB_RESUME_MAX_ATTEMPTS:
+                logging.warning("Job %s was interrupted %s times, giving up: %s", job_id, attempts, url)
+                record_job_stage('failed', job_id, error='Interrupted too many times')
+                complete_job(job_id)
+                active.release()
+                continue
+            record_job_stage('claimed', job_id, worker=worker_id)
+            future = executor.submit(run_claimed_job, job_id, url, checkpoint, platform_lease)
+            future.add_done_callback(lambda _: active.release())
+    flush_sheet_rows()
+    publish_process_metrics()
+    logging.info("Worker %s stopped", worker_id)
+
+# Process Metrics: in shared mode the jobs run in worker processes, so each one stores a snapshot
+# of its counters, histograms and job gauges in the journal database, and /metrics in the web
+# process sums them. Snapshots of exited processes keep counting toward the totals, so counters
+# never go backwards when a worker restarts, until prune_job_journal drops them; their gauges are
+# left out.
+
+def encode_metric_items(items):
+    return [[name, [list(label) for label in labels], value] for (name, labels), value in items.items()]
+
+def decode_metric_items(items):
+    return {(name, tuple(tuple(label) for label in labels)): value for name, labels, value in items}
+
+def get_local_gauges():
+    with jobs_lock:
+        job_counts = {}
+        for job in jobs.values():
+            job_counts[job['status']] = job_counts.get(job['status'], 0) + 1
+    with sheet_rows_condition:
+        pending_rows = len(pending_sheet_rows)
+    return job_counts, pending_rows
+
+def publish_process_metrics():
+    counters, histograms, buckets = snapshot_metrics()
+    job_counts, pending_rows = get_local_gauges()
+    data = {'counters': encode_metric_items(counters), 'histograms': encode_metric_items(histograms),
+            'buckets': buckets, 'jobs': job_counts, 'pending_sheet_rows': pending_rows}
+    connection = get_job_journal()
+    with connection:
+        connection.execute('INSERT OR REPLACE INTO process_metrics (owner, data, updated_at) VALUES (?, ?, ?)',
+                           (json.dumps(get_job_owner()), json.dumps(data), time.time()))
+
+def collect_process_metrics():
+    # This process's metrics plus every published snapshot: (snapshot, job_counts, pending_rows)
+    counters, histograms, buckets = snapshot_metrics()
+    job_counts, pending_rows = get_local_gauges()
+    rows = get_job_journal().execute('SELECT owner, data FROM process_metrics').fetchall()
+    for owner, data in rows:
+        owner = json.loads(owner)
+        if owner == get_job_owner():
+            continue
+        data = json.loads(data)
+        for key, value in decode_metric_items(data['counters']).items():
+            counters[key] = counters.get(key, 0) + value
+        for key, histogram in decode_metric_items(data['histograms']).items():
+            merged = histograms.get(key)
+            histograms[key] = [a + b for a, b in zip(merged, histogram)] if merged else histogram
+        for name, bounds in data['buckets'].items():
+            buckets.setdefault(name, tuple(bounds))
+        if is_job_owner_alive(owner):
+            for status, count in data['jobs'].items():
+                job_counts[status] = job_counts.get(status, 0) + count
+            pending_rows += data['pending_sheet_rows']
+    return (counters, histograms, buckets), job_counts, pending_rows
+
+def resume_from_checkpoint(checkpoint):
+    # Returns (video_path_or_drive_url, info) like process_url, or None if the job has to start over
+    info = checkpoint['info']
+    if checkpoint['stage'] == 'uploaded':
+        store = get_queue_store()
+        if store.has_video_key(get_video_key(info)) or store.has_url(info['source_url']):
+            logging.info("Row for resumed job was already written: %s", info['source_url'])
+        else:
+            append_video_row(info, checkpoint['drive_url'])
+        return checkpoint['drive_url'], info
+    video_path = checkpoint['video_path']
+    if not os.path.exists(video_path) or os.path.getsize(video_path) != checkpoint['size']:
+        logging.info("Download for resumed job is missing or incomplete: %s", video_path)
+        return None
+    if not process_video_data(video_path, info):
+        return None, None
+    return video_path, info
+
+# Google Services
+
+def get_google_services():
+    logging.debug("Attempting to get Google services.")
+    return get_services()
 
 def get_or_create_spreadsheet():
+    # The lookup, header row and public permission only run once per spreadsheet; afterwards
+    # the id comes from memory or SPREADSHEET_STATE_FILE until invalidate_spreadsheet is called
+    global SPREADSHEET_ID
+    with spreadsheet_id_lock:
+        state = load_spreadsheet_state()
+        if SPREADSHEET_ID and state.get('spreadsheet_id') in (None, SPREADSHEET_ID) and state.get('schema_verified'):
+            return SPREADSHEET_ID
+        if not SPREADSHEET_ID and state.get('spreadsheet_id') and state.get('schema_verified'):
+            SPREADSHEET_ID = state['spreadsheet_id']
+            return SPREADSHEET_ID
+
+        spreadsheet_id = bootstrap_spreadsheet(SPREADSHEET_ID or state.get('spreadsheet_id'))
+        save_spreadsheet_state({'name': SPREADSHEET_NAME, 'spreadsheet_id': spreadsheet_id, 'schema_verified': True})
+        SPREADSHEET_ID = spreadsheet_id
+        return spreadsheet_id
+
+def bootstrap_spreadsheet(spreadsheet_id=None):
     logging.debug("Attempting to get or create spreadsheet.")
     sheets_service, drive_service = get_google_services()
-    
-    results = drive_service.files().list(
-        q=f"name='{SPREADSHEET_NAME}' and mimeType='application/vnd.google-apps.spreadsheet'",
-        spaces='drive'
-    ).execute()
-    
-    spreadsheet_id = None
-    if results.get('files'):
-        spreadsheet_id = results['files'][0]['id']
-        logging.debug("Spreadsheet found.")
-        
-        values = [['Timestamp', 'Platform', 'Username', 'Source URL', 'Title', 'Description', 'Tags', 'Drive URL', 'Status']]
-        sheets_service.spreadsheets().values().update(
-            spreadsheetId=spreadsheet_id,
-            range='Queue!A1:I1',
-            valueInputOption='RAW',
-            body={'values': values}
+
+    if not spreadsheet_id:
+        results = drive_service.files().list(
+            q=f"name='{SPREADSHEET_NAME}' and mimeType='application/vnd.google-apps.spreadsheet'",
+            spaces='drive'
         ).execute()
-    else:
+        if results.get('files'):
+            spreadsheet_id = results['files'][0]['id']
+            logging.debug("Spreadsheet found.")
+
+    if not spreadsheet_id:
         logging.debug("Spreadsheet not found, creating new one.")
         spreadsheet = {
             'properties': {
@@ -158,18 +1037,17 @@ def get_or_create_spreadsheet():
                 }
             }]
         }
-        
+
         spreadsheet = sheets_service.spreadsheets().create(body=spreadsheet).execute()
         spreadsheet_id = spreadsheet['spreadsheetId']
-        
-        values = [['Timestamp', 'Platform', 'Username', 'Source URL', 'Title', 'Description', 'Tags', 'Drive URL', 'Status']]
-        sheets_service.spreadsheets().values().update(
-            spreadsheetId=spreadsheet_id,
-            range='Queue!A1:I1',
-            valueInputOption='RAW',
-            body={'values': values}
-        ).execute()
-    
+
+    sheets_service.spreadsheets().values().update(
+        spreadsheetId=spreadsheet_id,
+        range='Queue!A1:I1',
+        valueInputOption='RAW',
+        body={'values': [QUEUE_HEADERS]}
+    ).execute()
+
     try:
         permission = {
             'type': 'anyone',
@@ -179,10 +1057,10 @@ def get_or_create_spreadsheet():
             fileId=spreadsheet_id,
             body=permission
         ).execute()
-        logging.debug(f"Spreadsheet URL: https://docs.google.com/spreadsheets/d/{spreadsheet_id}")
+        logging.debug("Spreadsheet URL: https://docs.google.com/spreadsheets/d/%s", spreadsheet_id)
     except Exception as e:
-        logging.error(f"Error making spreadsheet public: {e}")
-    
+        logging.error("Error making spreadsheet public: %s", e)
+
     return spreadsheet_id
 
 def get_sheet():
@@ -192,68 +1070,47 @@ def get_sheet():
         spreadsheet_id = get_or_create_spreadsheet()
         return (sheets_service, spreadsheet_id)
     except Exception as e:
-        logging.error(f"Error getting sheet: {e}")
+        logging.error("Error getting sheet: %s", e)
         return None
 
-def is_url_in_queue(url, sheet_info):
-    logging.debug(f"Checking if URL is in queue: {url}")
+def is_url_in_queue(url, sheet_info=None):
+    # sheet_info is unused since the queue store owns its own connection
+    logging.debug("Checking if URL is in queue: %s", url)
     try:
-        if not sheet_info:
-            return False
-            
-        sheets_service, spreadsheet_id = sheet_info
-        
-        result = sheets_service.spreadsheets().values().get(
-            spreadsheetId=spreadsheet_id,
-            range='Queue!A:I'
-        ).execute()
-        
-        values = result.get('values', [])
-        
-        for row in values:
-            if len(row) > 3 and url in row[3]:  
-                logging.debug(f"URL found in queue: {url}")
-                return True
-        logging.debug(f"URL not found in queue: {url}")
-        return False
+        is_duplicate = get_queue_store().has_url(url)
+        logging.debug("URL %s in queue: %s", 'found' if is_duplicate else 'not found', url)
+        return is_duplicate
     except Exception as e:
-        logging.error(f"Error checking queue: {e}")
+        logging.error("Error checking queue: %s", e)
         return False
 
 def get_platform_and_username(metadata):
     url = metadata.get('source_url', '')
-    logging.debug(f"Getting platform and username for URL: {url}")
+    logging.debug("Getting platform and username for URL: %s", url)
     if "tiktok.com" in url:
-        logging.debug(f"Platform found: TikTok")
+        logging.debug("Platform found: TikTok")
         return "TikTok", metadata.get('uploader', 'Unknown')
     elif "youtube.com" in url or "youtu.be" in url:
-        logging.debug(f"Platform found: YouTube")
+        logging.debug("Platform found: YouTube")
         return "YouTube", metadata.get('uploader_id', 'Unknown')
     elif "tumblr.com" in url:
-        logging.debug(f"Platform found: Tumblr")
+        logging.debug("Platform found: Tumblr")
         return "Tumblr", metadata.get('uploader_id', 'Unknown')
     elif "pinterest.com" in url or "pin.it" in url:
-        logging.debug(f"Platform found: Pinterest")
+        logging.debug("Platform found: Pinterest")
         return "Pinterest", metadata.get('uploader_id', 'Unknown')
     elif "instagram.com" in url:
-        logging.debug(f"Platform found: Instagram")
+        logging.debug("Platform found: Instagram")
         return "Instagram", metadata.get('channel', 'Unknown')
         
-    logging.debug(f"Platform and username not found for URL: {url}")
+    logging.debug("Platform and username not found for URL: %s", url)
     return None, None
 
 def add_to_queue(video_path, metadata):
-    logging.debug(f"Adding video to queue: {video_path}")
+    logging.debug("Adding video to queue: %s", video_path)
     try:
-        sheet_info = get_sheet()
-        if not sheet_info:
-            logging.error("Failed to get sheet")
-            return
-
-        sheets_service, spreadsheet_id = sheet_info
-
-        if is_url_in_queue(metadata['webpage_url'], sheet_info):
-            logging.debug(f"Video already in queue: {metadata['webpage_url']}")
+        if is_url_in_queue(metadata['webpage_url']):
+            logging.debug("Video already in queue: %s", metadata['webpage_url'])
             if os.path.exists(video_path):
                 logging.debug("Removing local file as it's already in queue")
                 os.remove(video_path)  
@@ -277,37 +1134,458 @@ def add_to_queue(video_path, metadata):
             'pending'  
         ]]
 
-        sheets_service.spreadsheets().values().append(
-            spreadsheetId=spreadsheet_id,
-            range='Queue!A:I',  
-            valueInputOption='RAW',
-            insertDataOption='INSERT_ROWS',
-            body={'values': row}
-        ).execute()
-
-        logging.debug(f"Successfully added to queue: {metadata.get('title', 'Untitled')}")
+        get_queue_store().add_row(row[0])
+        logging.debug("Successfully added to queue: %s", metadata.get('title', 'Untitled'))
 
         if os.path.exists(video_path):
-            logging.debug(f"Removing local file: {video_path}")
+            logging.debug("Removing local file: %s", video_path)
             os.remove(video_path)
 
     except Exception as e:
-        logging.error(f"Error adding to queue: {e}")
+        logging.error("Error adding to queue: %s", e)
         if os.path.exists(video_path):
-            logging.debug(f"Removing local file after error: {video_path}")
+            logging.debug("Removing local file after error: %s", video_path)
             os.remove(video_path)  
 
 def upload_to_drive(video_path):
-    logging.debug(f"Uploading video to Drive: {video_path}")
+    logging.debug("Uploading video to Drive: %s", video_path)
     try:
         file_metadata = {'name': video_path.split('/')[-1]}
-        media = MediaFileUpload(video_path, mimetype='video/mp4')
-        file = drive_service.files().create(body=file_metadata, media_body=media, fields='webViewLink').execute()
+        media = MediaFileUpload(video_path, mimetype='video/mp4', chunksize=UPLOAD_CHUNK_SIZE, resumable=True)
+        stat = os.stat(video_path)
+        session_key = f"{os.path.abspath(video_path)}:{stat.st_size}:{int(stat.st_mtime)}"
+        upload_request = get_drive_service().files().create(body=file_metadata, media_body=media, fields='webViewLink')
+        file = run_resumable_upload(upload_request, session_key, file_metadata['name'])
         return file.get('webViewLink')
     except Exception as e:
-        logging.error(f"Error uploading to Drive: {str(e)}")
+        logging.error("Error uploading to Drive: %s", e)
         return None
 
+# Resumable Uploads
+
+# Session URIs live in the job journal database, so uploads survive restarts and worker processes
+# sharing the journal never overwrite each other's sessions
+
+upload_sessions_lock = threading.Lock()
+upload_sessions_imported = False
+
+def get_upload_sessions_db():
+    global upload_sessions_imported
+    connection = get_job_journal()
+    if not upload_sessions_imported:
+        with upload_sessions_lock:
+            if not upload_sessions_imported:
+                import_upload_sessions_file(connection)
+                upload_sessions_imported = True
+    return connection
+
+def import_upload_sessions_file(connection):
+    # Carries over the sessions an older version kept in UPLOAD_SESSIONS_FILE
+    if not os.path.exists(UPLOAD_SESSIONS_FILE):
+        return
+    try:
+        with open(UPLOAD_SESSIONS_FILE, 'r') as sessions_file:
+            sessions = json.load(sessions_file)
+    except (OSError, ValueError) as e:
+        logging.error("Error reading upload sessions: %s", e)
+        return
+    with connection:
+        connection.executemany('INSERT OR IGNORE INTO upload_sessions (session_key, uri, created_at) VALUES (?, ?, ?)',
+                               [(key, session['uri'], session['created_at']) for key, session in sessions.items()])
+    try:
+        os.remove(UPLOAD_SESSIONS_FILE)
+    except FileNotFoundError:
+        pass
+    logging.info("Imported %s upload sessions from %s", len(sessions), UPLOAD_SESSIONS_FILE)
+
+def get_upload_session(session_key):
+    row = get_upload_sessions_db().execute('SELECT uri FROM upload_sessions WHERE session_key = ? AND created_at >= ?',
+                                           (session_key, time.time() - UPLOAD_SESSION_MAX_AGE)).fetchone()
+    return row[0] if row else None
+
+def set_upload_session(session_key, uri):
+    connection = get_upload_sessions_db()
+    with connection:
+        if uri:
+            connection.execute('INSERT OR REPLACE INTO upload_sessions (session_key, uri, created_at) VALUES (?, ?, ?)',
+                               (session_key, uri, time.time()))
+        else:
+            connection.execute('DELETE FROM upload_sessions WHERE session_key = ?', (session_key,))
+
+def query_upload_progress(uri, total_size, http=None):
+    # Asks Drive how much of an interrupted session it already has; with a known total_size that
+    # covers every byte sent, the same empty request also finalizes the upload.
+    # Returns (bytes_received, None), (None, completed_file) or (None, None) if the session is gone.
+    headers = {'Content-Length': '0', 'Content-Range': f"bytes */{total_size if total_size is not None else '*'}"}
+    response, content = (http or get_authorized_http()).request(uri, 'PUT', headers=headers)
+    if response.status in (200, 201):
+        return None, json.loads(content)
+    if response.status == 308:
+        range_header = response.get('range')
+        return (int(range_header.rsplit('-', 1)[1]) + 1 if range_header else 0), None
+    return None, None
+
+def is_retryable_upload_error(error):
+    if isinstance(error, HttpError):
+        return error.resp.status in RETRYABLE_STATUS_CODES
+    return isinstance(error, (OSError, httplib2.HttpLib2Error))
+
+def run_resumable_upload(upload_request, session_key, name):
+    # Sends the upload chunk by chunk with exponential backoff, persisting the session URI
+    # so a restarted process resumes from the last byte Drive acknowledged
+    total_size = upload_request.resumable.size()
+    started_at = time.time()
+    start_offset = 0
+    retries = 0
+
+    saved_uri = get_upload_session(session_key) if session_key else None
+    if saved_uri:
+        progress, completed = query_upload_progress(saved_uri, total_size)
+        if completed is not None:
+            set_upload_session(session_key, None)
+            return completed
+        if progress is not None:
+            logging.info("Resuming upload of %s at byte %s", name, progress)
+            upload_request.resumable_uri = saved_uri
+            upload_request.resumable_progress = start_offset = progress
+
+    response = None
+    while response is None:
+        try:
+            size = upload_request.resumable.size()
+            if upload_request.resumable_uri and size is not None and upload_request.resumable_progress == size:
+                # A stream whose length is a multiple of the chunk size sent its last chunk as
+                # bytes a-b/*; next_chunk would follow with an invalid empty range, so finalize here
+                progress, response = query_upload_progress(upload_request.resumable_uri, size, upload_request.http)
+                if response is None:
+                    if progress is None:
+                        raise IOError(f"Upload session for {name} expired before it was finalized")
+                    upload_request.resumable_progress = progress
+                continue
+            status, response = upload_request.next_chunk(num_retries=0)
+            if session_key and upload_request.resumable_uri and upload_request.resumable_uri != saved_uri:
+                saved_uri = upload_request.resumable_uri
+                set_upload_session(session_key, saved_uri)
+            if status:
+                logging.debug("Uploaded %s%% of %s", int(status.progress() * 100), name)
+            retries = 0
+        except Exception as e:
+            if not is_retryable_upload_error(e) or retries >= UPLOAD_MAX_RETRIES:
+                raise
+            retries += 1
+            delay = min(2 ** retries, 64) + random.random()
+            logging.warning("Retryable upload error for %s (%s), retry %s in %.1fs", name, e, retries, delay)
+            time.sleep(delay)
+            if upload_request.resumable_uri:
+                progress, completed = query_upload_progress(upload_request.resumable_uri,
+                                                            upload_request.resumable.size(), upload_request.http)
+                if completed is not None:
+                    response = completed
+                elif progress is not None:
+                    upload_request.resumable_progress = progress
+
+    if session_key:
+        set_upload_session(session_key, None)
+    if total_size is None:
+        total_size = upload_request.resumable.size() or 0
+    record_upload_metrics(name, total_size - start_offset, time.time() - started_at, start_offset > 0)
+    return response
+
+def record_upload_metrics(name, bytes_sent, seconds, resumed):
+    # Transfer time only, unlike stage_duration_seconds{stage="upload"}, which includes waiting for a slot
+    mbps = round(bytes_sent * 8 / seconds / 1e6, 2) if seconds > 0 else 0.0
+    resumed = 'true' if resumed else 'false'
+    inc_counter('uploaded_bytes_total', bytes_sent)
+    observe_duration('upload_transfer_seconds', seconds, resumed=resumed)
+    if bytes_sent and seconds > 0:
+        observe_histogram('upload_throughput_mbps', mbps, THROUGHPUT_BUCKETS, resumed=resumed)
+    logging.info("Uploaded %s: %s bytes in %ss (%s Mbit/s)", name, bytes_sent, round(seconds, 3), mbps)
+
+# Streaming Uploads
+
+class StreamingMediaUpload(MediaUpload):
+    # Feeds a resumable upload from a bounded queue of downloaded blocks. Only the chunk
+    # currently being sent is retained, so a failed chunk can be resent but nothing earlier.
+
+    def __init__(self, blocks, mimetype='video/mp4', chunksize=UPLOAD_CHUNK_SIZE):
+        super().__init__()
+        self._blocks = blocks
+        self._mimetype = mimetype
+        self._chunksize = chunksize
+        self._buffer = bytearray()
+        self._offset = 0  # Stream offset of self._buffer[0]
+        self._size = None
+        self.bytes_read = 0
+
+    def chunksize(self):
+        return self._chunksize
+
+    def mimetype(self):
+        return self._mimetype
+
+    def size(self):
+        return self._size
+
+    def resumable(self):
+        return True
+
+    def getbytes(self, begin, length):
+        if begin < self._offset:
+            raise IOError(f"Cannot rewind stream to byte {begin}, buffer starts at {self._offset}")
+        del self._buffer[:begin - self._offset]
+        self._offset = begin
+        # Read one byte past the chunk so that a stream ending exactly on a chunk boundary is
+        # known to be complete once that chunk is sent, and run_resumable_upload can finalize it
+        while self._size is None and len(self._buffer) <= length:
+            block = self._blocks.get()
+            if isinstance(block, Exception):
+                raise block
+            if block is None:
+                self._size = self._offset + len(self._buffer)
+                break
+            self._buffer.extend(block)
+            self.bytes_read += len(block)
+        return bytes(self._buffer[:length])
+
+def select_stream_format(info, platform=None):
+    # Streaming needs a single progressive HTTP(S) file; merged DASH and HLS formats fall back to disk
+    if not info:
+        return None
+    candidates = [f for f in info.get('formats') or [info]
+                  if f.get('url') and f.get('protocol', 'https') in ('http', 'https')
+                  and f.get('vcodec') != 'none' and f.get('acodec') != 'none']
+    chosen = select_download_format(candidates, FORMAT_POLICIES.get(platform))
+    if chosen:
+        return chosen
+    mp4_candidates = [f for f in candidates if f.get('ext') == 'mp4']
+    # yt-dlp sorts formats from worst to best
+    return (mp4_candidates or candidates or [None])[-1]
+
+def stream_download(ydl, stream_format, blocks, hasher, platform):
+    # Producer: reads the format URL through yt-dlp's own opener (cookies, headers, proxies)
+    try:
+        response = ydl.urlopen(YdlRequest(stream_format['url'], headers=stream_format.get('http_headers') or {}))
+        while True:
+            block = response.read(STREAM_READ_SIZE)
+            if not block:
+                break
+            hasher.update(block)
+            inc_counter('downloaded_bytes_total', len(block), platform=platform)
+            blocks.put(block)
+        blocks.put(None)
+    except Exception as e:
+        logging.error("Error streaming download: %s", e)
+        blocks.put(e)
+
+def stream_to_drive(info, stream_format, platform):
+    # Download and upload overlap; peak memory is bounded by STREAM_BUFFER_BLOCKS plus one upload chunk
+    name = f"{info.get('extractor_key', 'video')}_{info.get('id', uuid.uuid4().hex)}.{stream_format.get('ext', 'mp4')}"
+    logging.debug("Streaming video to Drive: %s", name)
+    blocks = queue.Queue(maxsize=STREAM_BUFFER_BLOCKS)
+    hasher = hashlib.sha256()
+    with borrow_ydl(platform) as ydl:
+        producer = threading.Thread(target=stream_download, args=(ydl, stream_format, blocks, hasher, platform), daemon=True)
+        producer.start()
+        try:
+            media = StreamingMediaUpload(blocks, mimetype=f"video/{stream_format.get('ext', 'mp4')}")
+            upload_request = get_drive_service().files().create(body={'name': name}, media_body=media, fields='id, webViewLink')
+            file = run_resumable_upload(upload_request, None, name)
+            producer.join()
+            content_hash = hasher.hexdigest()
+            info['content_sha256'] = content_hash
+            # The hash is only known once the bytes are uploaded, so a duplicate is removed afterwards
+            existing_url = find_content(content_hash)
+            if existing_url:
+                logging.info("Streamed video matches existing upload %s, removing duplicate %s", existing_url, file.get('id'))
+                set_job_fields(reused_upload=True)
+                delete_drive_file(file.get('id'))
+                return existing_url
+            record_content(content_hash, media.bytes_read, file.get('webViewLink'))
+            return file.get('webViewLink')
+        except Exception as e:
+            logging.error("Error streaming to Drive: %s", e)
+            return None
+        finally:
+            # Unblock the producer if the upload stopped early
+            while producer.is_alive():
+                try:
+                    blocks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+def delete_drive_file(file_id):
+    try:
+        get_drive_service().files().delete(fileId=file_id).execute()
+    except Exception as e:
+        logging.error("Error deleting duplicate Drive file %s: %s", file_id, e)
+
+# Content Index: reposts of the same clip under different URLs have identical bytes, so the
+# SHA-256 of a download maps to the Drive URL of the first upload and later copies reuse it
+
+content_index_context = threading.local()
+
+def get_content_index():
+    connection = getattr(content_index_context, 'connection', None)
+    if connection is None:
+        connection = sqlite3.connect(CONTENT_INDEX_FILE, timeout=30)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS content (sha256 TEXT PRIMARY KEY, size INTEGER, drive_url TEXT, created_at REAL)')
+        content_index_context.connection = connection
+    return connection
+
+def hash_file(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as video_file:
+        for block in iter(lambda: video_file.read(STREAM_READ_SIZE), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+class DownloadHasher:
+    # Hashes a download while yt-dlp writes it: each progress hook reads the bytes appended to
+    # the .part file since the last one, while they are still in the page cache. The hash is only
+    # used if the finished file is exactly what was read, so merged formats and postprocessors
+    # that rewrite the file fall back to hash_file.
+    def __init__(self):
+        self.hasher = hashlib.sha256()
+        self.filename = None
+        self.offset = 0
+        self.finished_stat = None
+
+    def reset(self, filename):
+        self.hasher = hashlib.sha256()
+        self.filename = filename
+        self.offset = 0
+        self.finished_stat = None
+
+    def update(self, progress):
+        filename = progress.get('filename')
+        if progress['status'] not in ('downloading', 'finished') or not filename:
+            return
+        if filename != self.filename or progress.get('downloaded_bytes', self.offset) < self.offset:
+            # A different file, or the same one downloading again from the start
+            self.reset(filename)
+        finished = progress['status'] == 'finished'
+        path = filename if finished else progress.get('tmpfilename') or filename
+        try:
+            with open(path, 'rb') as video_file:
+                video_file.seek(self.offset)
+                for block in iter(lambda: video_file.read(STREAM_READ_SIZE), b''):
+                    self.hasher.update(block)
+                    self.offset += len(block)
+                if finished:
+                    stat = os.fstat(video_file.fileno())
+                    self.finished_stat = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            self.reset(None)
+
+    def digest_for(self, path):
+        # The hash of path if it is the file this hasher read to the end, else None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if path != self.filename or self.finished_stat != (stat.st_size, stat.st_mtime_ns) or self.offset != stat.st_size:
+            return None
+        return self.hasher.hexdigest()
+
+def update_download_hash(progress):
+    # yt-dlp progress hook, installed on every pooled YoutubeDL; hashes for the job on this thread
+    hasher = getattr(job_context, 'download_hasher', None)
+    if hasher:
+        hasher.update(progress)
+
+def take_download_hash(video_path):
+    hasher = getattr(job_context, 'download_hasher', None)
+    job_context.download_hasher = None
+    return hasher.digest_for(video_path) if hasher else None
+
+def find_content(content_hash):
+    row = get_content_index().execute('SELECT drive_url FROM content WHERE sha256 = ?', (content_hash,)).fetchone()
+    return row[0] if row else None
+
+def record_content(content_hash, size, drive_url):
+    connection = get_content_index()
+    with connection:
+        connection.execute('INSERT OR IGNORE INTO content (sha256, size, drive_url, created_at) VALUES (?, ?, ?, ?)',
+                           (content_hash, size, drive_url, time.time()))
+
+# Metadata Cache: sanitized yt-dlp info dicts on disk, keyed by (extractor_key, id) with every
+# normalized URL that resolved to it as an alias; evicted by TTL and then least recently used
+
+metadata_cache_context = threading.local()
+
+def get_metadata_cache():
+    connection = getattr(metadata_cache_context, 'connection', None)
+    if connection is None:
+        connection = sqlite3.connect(METADATA_CACHE_FILE, timeout=30)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.executescript('''
+            CREATE TABLE IF NOT EXISTS metadata (
+                video_key TEXT PRIMARY KEY, info BLOB, size INTEGER, created_at REAL, accessed_at REAL);
+            CREATE INDEX IF NOT EXISTS metadata_accessed_at ON metadata (accessed_at);
+            CREATE TABLE IF NOT EXISTS metadata_urls (url TEXT PRIMARY KEY, video_key TEXT);
+        ''')
+        metadata_cache_context.connection = connection
+    return connection
+
+def get_cached_metadata(url, video_key=None):
+    connection = get_metadata_cache()
+    if not video_key:
+        row = connection.execute('SELECT video_key FROM metadata_urls WHERE url = ?', (normalize_url(url),)).fetchone()
+        if not row:
+            return None
+        encoded_key = row[0]
+    else:
+        encoded_key = encode_video_key(video_key)
+    row = connection.execute('SELECT info, created_at FROM metadata WHERE video_key = ?', (encoded_key,)).fetchone()
+    if not row or time.time() - row[1] > METADATA_CACHE_TTL:
+        return None
+    with connection:
+        connection.execute('UPDATE metadata SET accessed_at = ? WHERE video_key = ?', (time.time(), encoded_key))
+    info = json.loads(zlib.decompress(row[0]))
+    info['_cached'] = True
+    return info
+
+def cache_metadata(info, *urls):
+    video_key = get_video_key(info)
+    if not video_key:
+        return
+    encoded_key = encode_video_key(video_key)
+    blob = zlib.compress(json.dumps(info, default=str).encode('utf-8'))
+    now = time.time()
+    aliases = {normalize_url(url) for url in urls + (info.get('webpage_url'), info.get('original_url')) if url}
+    connection = get_metadata_cache()
+    with connection:
+        connection.execute('INSERT OR REPLACE INTO metadata (video_key, info, size, created_at, accessed_at) '
+                           'VALUES (?, ?, ?, ?, ?)', (encoded_key, blob, len(blob), now, now))
+        connection.executemany('INSERT OR REPLACE INTO metadata_urls (url, video_key) VALUES (?, ?)',
+                               [(alias, encoded_key) for alias in aliases])
+    evict_metadata()
+
+def forget_metadata(url, video_key=None):
+    connection = get_metadata_cache()
+    with connection:
+        connection.execute('DELETE FROM metadata_urls WHERE url = ?', (normalize_url(url),))
+        if video_key:
+            connection.execute('DELETE FROM metadata WHERE video_key = ?', (encode_video_key(video_key),))
+
+def evict_metadata():
+    connection = get_metadata_cache()
+    with connection:
+        connection.execute('DELETE FROM metadata WHERE created_at < ?', (time.time() - METADATA_CACHE_TTL,))
+        total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM metadata').fetchone()[0]
+        if total > METADATA_CACHE_MAX_BYTES:
+            # Drop least recently used entries until back under budget
+            excess = total - METADATA_CACHE_MAX_BYTES
+            for encoded_key, size in connection.execute(
+                    'SELECT video_key, size FROM metadata ORDER BY accessed_at').fetchall():
+                connection.execute('DELETE FROM metadata WHERE video_key = ?', (encoded_key,))
+                excess -= size
+                if excess <= 0:
+                    break
+        connection.execute('DELETE FROM metadata_urls WHERE video_key NOT IN (SELECT video_key FROM metadata)')
+
 def update_google_sheet(metadata, drive_url):
     logging.debug("Updating Google Sheet with video metadata.")
     try:
@@ -330,52 +1608,66 @@ def update_google_sheet(metadata, drive_url):
             drive_url,  # Drive URL
             'pending'  # Status
         ]]
-        body = {'values': values}
-        range_name = f"{SHEET_NAME}!A1"
-        sheets_service.spreadsheets().values().append(spreadsheetId=SPREADSHEET_ID, range=range_name,
-                                                      valueInputOption="RAW", body=body).execute()
+        append_sheet_row(get_spreadsheet_id(), values[0])
+        add_url_to_index(metadata['source_url'])
     except Exception as e:
-        logging.error(f"Error updating Google Sheet: {str(e)}")
+        logging.error("Error updating Google Sheet: %s", e)
 
 def process_video_data(video_path, metadata):
-    logging.info(f"Uploading video to Google Drive: {video_path}")
+    logging.info("Uploading video to Google Drive: %s", video_path)
     try:
-        drive_url = upload_to_drive(video_path)
-        logging.info(f"Video uploaded to Google Drive: {drive_url}")
-        
-        # Ensure all metadata keys are present
-        metadata.setdefault('title', 'Untitled')
-        metadata.setdefault('uploader', 'Unknown')
-        metadata.setdefault('description', '')
-        metadata.setdefault('tags', [])
-        metadata.setdefault('source_url', '')
-        
-        # Determine platform and username using the helper function
-        platform, username = get_platform_and_username(metadata)
-        
-        # Check if URL is already in the sheet
-        if is_url_in_sheet(sheets_service, SPREADSHEET_ID, SHEET_NAME, metadata['source_url']):
-            logging.info("URL is already in the queue. Skipping.")
-            return
-        
-        # Prepare the data to match the spreadsheet columns
-        values = [[
-            datetime.now().isoformat(),  # Timestamp
-            platform,  # Platform
-            username,  # Username
-            metadata['source_url'],  # Source URL
-            metadata['title'],  # Title
-            metadata['description'],  # Description
-            ', '.join(metadata['tags']),  # Tags
-            drive_url,  # Drive URL
-            'pending'  # Status
-        ]]
-        body = {'values': values}
-        range_name = f"{SHEET_NAME}!A1"
-        sheets_service.spreadsheets().values().append(spreadsheetId=SPREADSHEET_ID, range=range_name,
-                                                      valueInputOption="RAW", body=body).execute()
+        content_hash = take_download_hash(video_path)
+        if not content_hash:
+            with stage_timer('hash'):
+                content_hash = hash_file(video_path)
+        metadata['content_sha256'] = content_hash
+        drive_url = find_content(content_hash)
+        if drive_url:
+            logging.info("Video content already uploaded, reusing %s", drive_url)
+            set_job_fields(reused_upload=True)
+        else:
+            with upload_slots, stage_timer('upload'):
+                set_job_status('uploading')
+                drive_url = upload_to_drive(video_path)
+            if not drive_url:
+                return None
+            record_content(content_hash, os.path.getsize(video_path), drive_url)
+            logging.info("Video uploaded to Google Drive: %s", drive_url)
+        record_job_stage('uploaded', drive_url=drive_url, info=journal_metadata(metadata))
+        append_video_row(metadata, drive_url)
+        return drive_url
     except Exception as e:
-        logging.error(f"Error processing video data: {str(e)}")
+        logging.error("Error processing video data: %s", e)
+        return None
+
+def append_video_row(metadata, drive_url):
+    # Ensure all metadata keys are present
+    metadata.setdefault('title', 'Untitled')
+    metadata.setdefault('uploader', 'Unknown')
+    metadata.setdefault('description', '')
+    metadata.setdefault('tags', [])
+    metadata.setdefault('source_url', '')
+
+    # Determine platform and username using the helper function
+    platform, username = get_platform_and_username(metadata)
+
+    # Prepare the data to match the spreadsheet columns
+    values = [[
+        datetime.now().isoformat(),  # Timestamp
+        platform,  # Platform
+        username,  # Username
+        metadata['source_url'],  # Source URL
+        metadata['title'],  # Title
+        metadata['description'],  # Description
+        ', '.join(metadata['tags']),  # Tags
+        drive_url,  # Drive URL
+        'pending'  # Status
+    ]]
+    row_number = get_queue_store().add_row(values[0], get_video_key(metadata))
+    if row_number is not None:
+        # The SQLite backend fills the row in once the mirror has appended it
+        set_job_fields(row=row_number)
+    return row_number
 
 def upload_video_to_drive(video_data):
     logging.debug("Uploading video to Google Drive...")
@@ -383,7 +1675,7 @@ def upload_video_to_drive(video_data):
         # Implement upload logic here
         logging.debug("Video uploaded to Google Drive successfully.")
     except Exception as e:
-        logging.error(f"Error uploading video to Google Drive: {str(e)}")
+        logging.error("Error uploading video to Google Drive: %s", e)
 
 def add_to_google_sheet(metadata):
     logging.debug("Adding video information to Google Sheet...")
@@ -407,122 +1699,1210 @@ def add_to_google_sheet(metadata):
             'pending'
         ]
 
-        sheets_service.spreadsheets().values().append(
-            spreadsheetId=spreadsheet_id,
-            range='Queue!A:I',
-            valueInputOption='RAW',
-            insertDataOption='INSERT_ROWS',
-            body={'values': [row]}
-        ).execute()
-        
+        append_sheet_row(spreadsheet_id, row)
+        add_url_to_index(metadata.get('webpage_url', ''))
+
         logging.debug("Video information added to Google Sheet successfully.")
     except Exception as e:
-        logging.error(f"Error adding to Google Sheet: {str(e)}")
+        logging.error("Error adding to Google Sheet: %s", e)
+
+# yt-dlp Pool: YoutubeDL instances are not safe to share between concurrent downloads, so each
+# platform keeps up to YDL_POOL_SIZE warm instances (extractors, cookie jar, HTTP sessions)
+# that are checked out by one job at a time instead of being rebuilt per video
+
+ydl_factory = yt_dlp.YoutubeDL  # Swappable, e.g. for the local stand-in used by benchmark.py
+ydl_pools = {}  # platform -> LifoQueue of idle instances, most recently used first
+ydl_pool_counts = {}  # platform -> instances created
+ydl_pool_lock = threading.Lock()
+
+def get_url_platform(url):
+    if "tiktok.com" in url:
+        return 'TikTok'
+    elif "instagram.com" in url:
+        return 'Instagram'
+    elif "youtube.com" in url or "youtu.be" in url:
+        return 'YouTube'
+    return None
 
-def download_video_tiktok(url):
-    logging.debug(f"Downloading TikTok video: {url}")
+@contextmanager
+def borrow_ydl(platform):
+    with ydl_pool_lock:
+        pool = ydl_pools.setdefault(platform, queue.LifoQueue())
+        create = pool.empty() and ydl_pool_counts.get(platform, 0) < YDL_POOL_SIZE
+        if create:
+            ydl_pool_counts[platform] = ydl_pool_counts.get(platform, 0) + 1
+    if create:
+        logging.debug("Creating YoutubeDL instance for %s", platform)
+        try:
+            ydl = ydl_factory(dict(YDL_OPTIONS[platform], progress_hooks=[update_download_hash]))
+        except Exception:
+            with ydl_pool_lock:
+                ydl_pool_counts[platform] -= 1
+            raise
+    else:
+        ydl = pool.get()
     try:
-        ydl_opts = {
-            'format': 'best[ext=mp4]',
-            'outtmpl': os.path.join(OUTPUT_FOLDER, '%(extractor_key)s_%(id)s.%(ext)s'),
-            'quiet': True
+        yield ydl
+    finally:
+        pool.put(ydl)
+
+def close_ydl_pools():
+    # Persists cookie jars and closes pooled HTTP sessions
+    with ydl_pool_lock:
+        pools = list(ydl_pools.values())
+    for pool in pools:
+        while not pool.empty():
+            try:
+                pool.get_nowait().close()
+            except Exception as e:
+                logging.error("Error closing YoutubeDL instance: %s", e)
+
+atexit.register(close_ydl_pools)
+
+# Platform Scheduling: each platform gets its own concurrency limit and token bucket. Jobs wait
+# in their platform's queue and are only handed to a worker thread once that platform has both a
+# free slot and a token, so a burst for one site never holds threads the other sites could use.
+# A job holds its slot from dispatch until its download finishes and spends one token per video,
+# covering both the pre-flight extraction and the download.
+
+class PlatformLimiter:
+    def __init__(self, platform, concurrency, per_minute):
+        self.platform = platform
+        self.concurrency = concurrency
+        self.rate = per_minute / 60.0
+        self.capacity = float(max(1, concurrency))
+        self.tokens = self.capacity
+        self.refilled_at = time.time()
+        self.backoff = 0.0
+        self.backoff_until = 0.0
+        self.pending = deque()  # (job_id, url, executor) waiting for dispatch, guarded by dispatch_condition
+        self.waiting = 0  # Threads blocked in acquire()
+        self.active = 0
+        self.lock = threading.Lock()
+
+    def refill(self, now):
+        # Caller holds self.lock
+        self.tokens = min(self.capacity, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+
+    def try_acquire(self):
+        with self.lock:
+            now = time.time()
+            self.refill(now)
+            if self.active >= self.concurrency or now < self.backoff_until or self.tokens < 1:
+                return False
+            self.tokens -= 1
+            self.active += 1
+            return True
+
+    def is_ready(self):
+        # Whether try_acquire would succeed right now, without taking anything
+        with self.lock:
+            now = time.time()
+            self.refill(now)
+            return self.active < self.concurrency and now >= self.backoff_until and self.tokens >= 1
+
+    def ready_in(self):
+        # Seconds until a token is available and any backoff is over; slots are freed by release()
+        with self.lock:
+            now = time.time()
+            self.refill(now)
+            delay = max(0.0, self.backoff_until - now)
+            if self.tokens < 1:
+                delay = max(delay, (1 - self.tokens) / self.rate if self.rate > 0 else 1.0)
+            return delay
+
+    def acquire(self):
+        # Blocking variant for callers that were not dispatched through the platform queue
+        with self.lock:
+            self.waiting += 1
+        try:
+            while not self.try_acquire():
+                time.sleep(min(max(self.ready_in(), 0.05), 5.0))
+        finally:
+            with self.lock:
+                self.waiting -= 1
+
+    def release(self):
+        with self.lock:
+            self.active -= 1
+        with dispatch_condition:
+            dispatch_condition.notify()
+
+    def note_rate_limited(self):
+        with self.lock:
+            self.backoff = min(max(self.backoff * 2, 15.0), RATE_LIMIT_BACKOFF_MAX)
+            self.backoff_until = time.time() + self.backoff
+            self.tokens = 0.0
+        logging.warning("%s is rate limiting us, backing off for %.0fs", self.platform, self.backoff)
+
+    def note_success(self):
+        with self.lock:
+            if time.time() >= self.backoff_until:
+                self.backoff = 0.0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'waiting': self.waiting + len(self.pending),
+                'active': self.active,
+                'tokens': round(self.tokens, 2),
+                'backoff_seconds': round(max(0.0, self.backoff_until - time.time()), 1)
+            }
+
+class SharedPlatformLimiter(PlatformLimiter):
+    # In shared mode the bucket and backoff live in the job journal database and every slot is a
+    # lease row there, so the limits hold across all worker processes rather than once per
+    # process, and a 429 seen by one process pauses the others. A lease is held by the job it was
+    # taken for and counts until it is released or its process has exited.
+
+    def load_state(self, connection, now):
+        # (tokens, backoff, backoff_until, active) as of now
+        row = connection.execute('SELECT tokens, refilled_at, backoff, backoff_until FROM platform_state '
+                                 'WHERE platform = ?', (self.platform,)).fetchone()
+        tokens, refilled_at, backoff, backoff_until = row or (self.capacity, now, 0.0, 0.0)
+        tokens = min(self.capacity, tokens + max(0.0, now - refilled_at) * self.rate)
+        owners = connection.execute('SELECT owner FROM platform_leases WHERE platform = ?', (self.platform,)).fetchall()
+        active = sum(1 for (owner,) in owners if is_job_owner_alive(json.loads(owner)))
+        return tokens, backoff, backoff_until, active
+
+    def save_state(self, connection, now, tokens, backoff, backoff_until):
+        connection.execute('INSERT OR REPLACE INTO platform_state (platform, tokens, refilled_at, backoff, backoff_until) '
+                           'VALUES (?, ?, ?, ?, ?)', (self.platform, tokens, now, backoff, backoff_until))
+
+    def is_ready_at(self, connection, now):
+        tokens, _, backoff_until, active = self.load_state(connection, now)
+        return active < self.concurrency and now >= backoff_until and tokens >= 1
+
+    def take_lease(self, connection, lease_id, now):
+        # Caller holds the database write lock (BEGIN IMMEDIATE)
+        for (owner,) in connection.execute('SELECT DISTINCT owner FROM platform_leases WHERE platform = ?',
+                                           (self.platform,)).fetchall():
+            if not is_job_owner_alive(json.loads(owner)):
+                connection.execute('DELETE FROM platform_leases WHERE platform = ? AND owner = ?', (self.platform, owner))
+        tokens, backoff, backoff_until, active = self.load_state(connection, now)
+        if active >= self.concurrency or now < backoff_until or tokens < 1:
+            return False
+        self.save_state(connection, now, tokens - 1, backoff, backoff_until)
+        connection.execute('INSERT OR REPLACE INTO platform_leases (platform, lease_id, owner, acquired_at) '
+                           'VALUES (?, ?, ?, ?)', (self.platform, lease_id, json.dumps(get_job_owner()), now))
+        return True
+
+    def try_acquire(self):
+        connection = get_job_journal()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            return self.take_lease(connection, get_lease_id(), time.time())
+
+    def is_ready(self):
+        return self.is_ready_at(get_job_journal(), time.time())
+
+    def ready_in(self):
+        now = time.time()
+        tokens, _, backoff_until, _ = self.load_state(get_job_journal(), now)
+        delay = max(0.0, backoff_until - now)
+        if tokens < 1:
+            delay = max(delay, (1 - tokens) / self.rate if self.rate > 0 else 1.0)
+        return delay
+
+    def release(self):
+        connection = get_job_journal()
+        with connection:
+            connection.execute('DELETE FROM platform_leases WHERE platform = ? AND lease_id = ?',
+                               (self.platform, get_lease_id()))
+        with dispatch_condition:
+            dispatch_condition.notify()
+
+    def note_rate_limited(self):
+        connection = get_job_journal()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            now = time.time()
+            _, backoff, _, _ = self.load_state(connection, now)
+            backoff = min(max(backoff * 2, 15.0), RATE_LIMIT_BACKOFF_MAX)
+            self.save_state(connection, now, 0.0, backoff, now + backoff)
+        logging.warning("%s is rate limiting us, backing off for %.0fs in every worker", self.platform, backoff)
+
+    def note_success(self):
+        connection = get_job_journal()
+        with connection:
+            connection.execute('UPDATE platform_state SET backoff = 0 WHERE platform = ? AND backoff > 0 '
+                               'AND backoff_until <= ?', (self.platform, time.time()))
+
+    def stats(self):
+        now = time.time()
+        tokens, _, backoff_until, active = self.load_state(get_job_journal(), now)
+        return {
+            'waiting': self.waiting + len(self.pending),
+            'active': active,
+            'tokens': round(tokens, 2),
+            'backoff_seconds': round(max(0.0, backoff_until - now), 1)
         }
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
+
+def get_lease_id():
+    # Leases taken for a job are keyed by its id, so whichever thread runs the job can release it
+    return getattr(job_context, 'job_id', None) or f"thread-{threading.get_ident()}"
+
+platform_limiters = {}
+platform_limiters_lock = threading.Lock()
+dispatch_condition = threading.Condition()
+platform_dispatcher = None
+
+def get_platform_limiter(platform):
+    with platform_limiters_lock:
+        if platform not in platform_limiters:
+            limits = PLATFORM_LIMITS.get(platform, {})
+            limiter_class = SharedPlatformLimiter if JOB_QUEUE_MODE == 'shared' else PlatformLimiter
+            platform_limiters[platform] = limiter_class(
+                platform, limits.get('concurrency', 2), limits.get('per_minute', 30))
+        return platform_limiters[platform]
+
+def dispatch_job(job_id, url, checkpoint=None, executor=None):
+    # Jobs resuming past the download, or for URLs no platform claims, go straight to a worker
+    global platform_dispatcher
+    executor = executor or job_executor
+    platform = None if checkpoint else get_url_platform(url)
+    if not platform:
+        executor.submit(run_job, job_id, url, checkpoint)
+        return
+    limiter = get_platform_limiter(platform)
+    with dispatch_condition:
+        limiter.pending.append((job_id, url, executor))
+        if platform_dispatcher is None:
+            platform_dispatcher = threading.Thread(target=run_platform_dispatcher, name='platform-dispatcher',
+                                                   daemon=True)
+            platform_dispatcher.start()
+        dispatch_condition.notify()
+
+def run_platform_dispatcher():
+    with dispatch_condition:
+        while True:
+            dispatch_condition.wait(dispatch_ready_jobs())
+
+def dispatch_ready_jobs():
+    # Caller holds dispatch_condition. Returns seconds until a waiting platform gets a token,
+    # or None if every waiting platform only needs a slot (release() wakes the dispatcher).
+    with platform_limiters_lock:
+        limiters = list(platform_limiters.values())
+    next_check = None
+    for limiter in limiters:
+        while limiter.pending and limiter.try_acquire():
+            job_id, url, executor = limiter.pending.popleft()
+            executor.submit(run_job, job_id, url, None, limiter)
+        if limiter.pending:
+            delay = limiter.ready_in()
+            if delay > 0:
+                next_check = delay if next_check is None else min(next_check, delay)
+    return next_check
+
+def count_dispatch_pending():
+    with dispatch_condition:
+        with platform_limiters_lock:
+            return sum(len(limiter.pending) for limiter in platform_limiters.values())
+
+def release_platform_lease():
+    # Frees the job's platform slot as soon as it has finished talking to the platform
+    limiter = getattr(job_context, 'platform_lease', None)
+    if limiter:
+        job_context.platform_lease = None
+        limiter.release()
+
+def is_rate_limit_error(error):
+    message = str(error).lower()
+    return (isinstance(error, HttpError) and error.resp.status == 429) or any(
+        marker in message for marker in ('http error 429', 'too many requests', 'rate-limit', 'rate limit'))
+
+def check_rate_limited(platform, error):
+    if platform and is_rate_limit_error(error):
+        get_platform_limiter(platform).note_rate_limited()
+
+@contextmanager
+def platform_slot(platform):
+    # Dispatched jobs already hold their platform's slot; anything else waits for one here
+    if not platform:
+        yield
+        return
+    limiter = get_platform_limiter(platform)
+    leased = getattr(job_context, 'platform_lease', None) is limiter
+    if not leased:
+        limiter.acquire()
+    try:
+        try:
+            yield
+        except Exception as e:
+            check_rate_limited(platform, e)
+            raise
+        limiter.note_success()
+    finally:
+        if not leased:
+            limiter.release()
+
+def get_platform_stats():
+    if JOB_QUEUE_MODE == 'shared':
+        # The shared limits are read from the journal, so the web process reports what the workers use
+        for platform in PLATFORM_LIMITS:
+            get_platform_limiter(platform)
+    with platform_limiters_lock:
+        limiters = list(platform_limiters.values())
+    return {limiter.platform: limiter.stats() for limiter in limiters}
+
+# Format Policy: picks the rendition to download from the format list the pre-flight
+# extraction already returned, so only the size the queue needs is transferred
+
+CODEC_ALIASES = {
+    'h264': ('avc1', 'avc3', 'h264'),
+    'h265': ('hvc1', 'hev1', 'hevc', 'h265'),
+    'vp9': ('vp09', 'vp9'),
+    'av1': ('av01', 'av1')
+}
+
+def get_format_size(video_format):
+    return video_format.get('filesize') or video_format.get('filesize_approx')
+
+def get_codec_rank(vcodec, codecs):
+    vcodec = (vcodec or '').lower()
+    for rank, codec in enumerate(codecs):
+        if vcodec.startswith(CODEC_ALIASES.get(codec, (codec,))):
+            return rank
+    return len(codecs)
+
+def select_download_format(formats, policy):
+    # Returns the format dict the policy prefers, or None to leave the choice to yt-dlp
+    if not formats or not policy:
+        return None
+    candidates = [f for f in formats if f.get('format_id') and f.get('vcodec') != 'none' and f.get('acodec') != 'none']
+    if policy.get('ext'):
+        candidates = [f for f in candidates if f.get('ext') == policy['ext']] or candidates
+    max_height = policy.get('max_height')
+    max_filesize = policy.get('max_filesize')
+    allowed = [f for f in candidates
+               if (not max_height or (f.get('height') or 0) <= max_height)
+               and (not max_filesize or (get_format_size(f) or 0) <= max_filesize)]
+    if not allowed:
+        return None
+    codecs = policy.get('codecs') or []
+    direction = 1 if policy.get('smallest', True) else -1
+
+    def sort_key(video_format):
+        size = get_format_size(video_format)
+        return (-(video_format.get('height') or 0),
+                get_codec_rank(video_format.get('vcodec'), codecs),
+                size is None,
+                direction * (size or 0),
+                direction * (video_format.get('tbr') or 0))
+
+    return min(allowed, key=sort_key)
+
+def apply_format_policy(info, platform):
+    chosen = select_download_format(info.get('formats'), FORMAT_POLICIES.get(platform))
+    if not chosen:
+        return info
+    logging.debug("Selected format %s (%sp, %s, %s bytes) for %s", chosen['format_id'], chosen.get('height'),
+                  chosen.get('vcodec'), get_format_size(chosen), info.get('webpage_url'))
+    # With a single format left, the YDL_OPTIONS format spec can only pick that one
+    return dict(info, formats=[chosen])
+
+def download_with_ydl(ydl, url, info=None, platform=None):
+    # Reuse the metadata from the pre-flight check instead of extracting the page a second time
+    if not info:
+        info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+    return ydl.process_ie_result(apply_format_policy(info, platform), download=True)
+
+def download_video_tiktok(url, info=None):
+    logging.debug("Downloading TikTok video: %s", url)
+    try:
+        with borrow_ydl('TikTok') as ydl:
+            info = download_with_ydl(ydl, url, info, 'TikTok')
             video_path = ydl.prepare_filename(info)
-            logging.debug(f"Video downloaded to: {video_path}")
+            logging.debug("Video downloaded to: %s", video_path)
             return video_path, info
     except Exception as e:
-        logging.error(f"Failed to download TikTok video: {url}. Error: {str(e)}")
+        logging.error("Failed to download TikTok video: %s. Error: %s", url, e)
+        check_rate_limited('TikTok', e)
         return None, None
 
-def download_video_instagram(url):
-    logging.debug(f"Downloading Instagram video: {url}")
+def download_video_instagram(url, info=None):
+    logging.debug("Downloading Instagram video: %s", url)
     try:
-        ydl_opts = {
-            'format': 'best[ext=mp4]',
-            'outtmpl': os.path.join(OUTPUT_FOLDER, '%(extractor_key)s_%(id)s.%(ext)s'),
-            'quiet': True
-        }
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
+        with borrow_ydl('Instagram') as ydl:
+            info = download_with_ydl(ydl, url, info, 'Instagram')
             video_path = ydl.prepare_filename(info)
-            logging.debug(f"Video downloaded to: {video_path}")
+            logging.debug("Video downloaded to: %s", video_path)
             return video_path, info
     except Exception as e:
-        logging.error(f"Failed to download Instagram video: {url}. Error: {str(e)}")
+        logging.error("Failed to download Instagram video: %s. Error: %s", url, e)
+        check_rate_limited('Instagram', e)
         return None, None
 
-def download_video_youtube(url):
-    logging.info(f"Downloading YouTube video from URL: {url}")
+def download_video_youtube(url, info=None):
+    logging.info("Downloading YouTube video from URL: %s", url)
     try:
-        ydl_opts = {
-            'format': 'best',
-            'outtmpl': '%(title)s.%(ext)s',
-            'noplaylist': True,
-            'cookiefile': 'cookies.txt'  # Path to your cookies file
-            # Alternatively, use 'cookiesfrombrowser': 'chrome' for browser cookies
-        }
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info_dict = ydl.extract_info(url, download=True)
+        with borrow_ydl('YouTube') as ydl:
+            info_dict = download_with_ydl(ydl, url, info, 'YouTube')
             video_path = ydl.prepare_filename(info_dict)
             video_id = info_dict.get('id', 'Unknown')
             return video_path, info_dict, video_id
     except Exception as e:
-        logging.error(f"Failed to download YouTube video: {str(e)}")
+        logging.error("Failed to download YouTube video: %s", e)
+        check_rate_limited('YouTube', e)
         return None, None, 'Unknown'
 
-def process_url(url):
-    logging.info(f"Processing URL: {url}")
-    try:
-        if "tiktok.com" in url:
-            logging.debug("Detected TikTok URL.")
-            video_path, info = download_video_tiktok(url)
-        elif "instagram.com" in url:
-            logging.debug("Detected Instagram URL.")
-            video_path, info = download_video_instagram(url)
-        elif "youtube.com" in url or "youtu.be" in url:
-            logging.debug("Detected YouTube URL.")
-            video_path, info, _ = download_video_youtube(url)
-        else:
+def download_for_platform(platform, url, info=None):
+    if platform == 'TikTok':
+        logging.debug("Detected TikTok URL.")
+        return download_video_tiktok(url, info)
+    elif platform == 'Instagram':
+        logging.debug("Detected Instagram URL.")
+        return download_video_instagram(url, info)
+    elif platform == 'YouTube':
+        logging.debug("Detected YouTube URL.")
+        video_path, info, _ = download_video_youtube(url, info)
+        return video_path, info
+    return None, None
+
+def preflight_url(url):
+    # Canonicalize, check the queue and extract metadata only, all before any bytes are downloaded
+    canonical_url = canonicalize_url(url)
+    logging.debug("Pre-flight check for URL: %s", canonical_url)
+    store = get_queue_store()
+    with stage_timer('dedup'):
+        is_duplicate = store.has_url(canonical_url)
+    if is_duplicate:
+        logging.info("URL is already in the queue. Skipping: %s", canonical_url)
+        return canonical_url, None, True
+
+    platform = get_url_platform(canonical_url)
+    if not platform:
+        return canonical_url, None, False
+    info = get_cached_metadata(canonical_url, video_key_from_url(canonical_url))
+    if info:
+        logging.debug("Metadata cache hit for URL: %s", canonical_url)
+    else:
+        with platform_slot(platform), borrow_ydl(platform) as ydl, stage_timer('resolve', platform=platform):
+            info = ydl.sanitize_info(ydl.extract_info(canonical_url, download=False))
+        cache_metadata(info, canonical_url)
+
+    video_key = get_video_key(info)
+    with stage_timer('dedup'):
+        is_duplicate = store.has_video_key(video_key)
+    if is_duplicate:
+        logging.info("Video %s is already in the queue. Skipping: %s", video_key, canonical_url)
+        return canonical_url, info, True
+    return canonical_url, info, False
+
+def process_url(url, checkpoint=None):
+    logging.info("Processing URL: %s", url)
+    reserved = []
+    try:
+        if checkpoint:
+            reserved = [checkpoint['info']['source_url'], get_video_key(checkpoint['info'])]
+            if not reserve_in_flight(reserved):
+                logging.info("URL is already being processed. Skipping: %s", url)
+                reserved = []
+                set_job_status('skipped')
+                return None, None
+            result = resume_from_checkpoint(checkpoint)
+            if result:
+                return result
+            release_in_flight(reserved)
+            reserved = []
+
+        canonical_url, preflight_info, is_duplicate = preflight_url(url)
+        reserved = [canonical_url, get_video_key(preflight_info)] if preflight_info else [canonical_url]
+        if is_duplicate or not reserve_in_flight(reserved):
+            if not is_duplicate:
+                logging.info("URL is already being processed. Skipping: %s", canonical_url)
+            reserved = []
+            set_job_status('skipped')
+            return None, None
+
+        stream_format = select_stream_format(preflight_info, get_url_platform(canonical_url)) if STREAM_UPLOADS else None
+        if stream_format:
+            with platform_slot(get_url_platform(canonical_url)), download_slots, upload_slots, stage_timer('stream'):
+                set_job_status('streaming')
+                drive_url = stream_to_drive(preflight_info, stream_format, get_url_platform(canonical_url))
+                if not drive_url and preflight_info.get('_cached'):
+                    # Cached format URLs may have expired; drop the entry and stream from a fresh extraction
+                    forget_metadata(canonical_url, get_video_key(preflight_info))
+                    platform = get_url_platform(canonical_url)
+                    with borrow_ydl(platform) as ydl, stage_timer('resolve', platform=platform):
+                        preflight_info = ydl.sanitize_info(ydl.extract_info(canonical_url, download=False))
+                    cache_metadata(preflight_info, canonical_url)
+                    stream_format = select_stream_format(preflight_info, platform)
+                    if stream_format:
+                        drive_url = stream_to_drive(preflight_info, stream_format, platform)
+            release_platform_lease()
+            if not stream_format:
+                logging.info("Fresh metadata has no streamable format, downloading to disk: %s", canonical_url)
+            elif not drive_url:
+                logging.warning("Failed to stream video to Drive.")
+                return None, None
+            else:
+                preflight_info['source_url'] = canonical_url
+                record_job_stage('uploaded', drive_url=drive_url, info=journal_metadata(preflight_info))
+                append_video_row(preflight_info, drive_url)
+                logging.info("Video processing completed.")
+                return drive_url, preflight_info
+
+        platform = get_url_platform(canonical_url)
+        if not platform:
             logging.warning("Unsupported URL format.")
             return None, None
+        with platform_slot(platform), download_slots, stage_timer('download', platform=platform):
+            set_job_status('downloading')
+            job_context.download_hasher = DownloadHasher()
+            video_path, info = download_for_platform(platform, canonical_url, preflight_info)
+            if not video_path and preflight_info and preflight_info.get('_cached'):
+                # Cached format URLs may have expired; drop the entry and extract afresh
+                forget_metadata(canonical_url, get_video_key(preflight_info))
+                video_path, info = download_for_platform(platform, canonical_url, None)
+        release_platform_lease()
 
         if not video_path or not info:
             logging.warning("Failed to download video or extract metadata.")
             return None, None
+        if os.path.exists(video_path):
+            inc_counter('downloaded_bytes_total', os.path.getsize(video_path), platform=platform)
 
-        # Add source URL to metadata
-        info['source_url'] = url
+        # Add canonical source URL to metadata
+        info['source_url'] = canonical_url
+        if os.path.exists(video_path):
+            record_job_stage('downloaded', video_path=video_path, size=os.path.getsize(video_path),
+                             info=journal_metadata(info))
 
+        if not process_video_data(video_path, info):
+            logging.warning("Failed to upload video or add it to the queue.")
+            return None, None
         logging.info("Video processing completed.")
-        process_video_data(video_path, info)
         return video_path, info
     except Exception as e:
-        logging.error(f"Error processing URL: {url}. Error: {str(e)}")
+        logging.error("Error processing URL: %s. Error: %s", url, e)
         return None, None
+    finally:
+        release_in_flight(reserved)
 
 def is_url_in_sheet(sheets_service, spreadsheet_id, sheet_name, url):
-    # Compare full URL including query parameters
-    logging.debug(f"Checking full URL: {url}")
-    
-    # Retrieve existing URLs from the sheet
-    result = sheets_service.spreadsheets().values().get(
-        spreadsheetId=spreadsheet_id,
-        range=f"{sheet_name}!D:D"  # Assuming URLs are in column D
-    ).execute()
-    
-    existing_urls = result.get('values', [])
-    # Flatten the list and compare
-    existing_urls = [row[0] for row in existing_urls if row]
-    logging.debug(f"Existing URLs in sheet: {existing_urls}")
-    
-    is_duplicate = url in existing_urls
-    logging.debug(f"Is duplicate: {is_duplicate}")
+    # Compare normalized URL against the in-memory index of column D
+    logging.debug("Checking URL: %s", url)
+    is_duplicate = is_url_indexed(sheets_service, spreadsheet_id, sheet_name, url)
+    logging.debug("Is duplicate: %s", is_duplicate)
     return is_duplicate
 
+# Batched Sheet Writes: rows are buffered and appended together, so one API call
+# covers up to SHEET_BATCH_SIZE videos instead of one call per video
+
+pending_sheet_rows = []  # (queued_at, spreadsheet_id, row, future)
+sheet_rows_condition = threading.Condition()
+sheet_flusher = None
+
+def queue_sheet_row(spreadsheet_id, row):
+    global sheet_flusher
+    future = Future()
+    with sheet_rows_condition:
+        pending_sheet_rows.append((time.time(), spreadsheet_id, row, future))
+        if sheet_flusher is None:
+            sheet_flusher = threading.Thread(target=run_sheet_flusher, name='sheet-flusher', daemon=True)
+            sheet_flusher.start()
+        sheet_rows_condition.notify()
+    return future
+
+def append_sheet_row(spreadsheet_id, row):
+    # Blocks until the batch containing the row is written and returns its row number
+    return queue_sheet_row(spreadsheet_id, row).result(timeout=SHEET_APPEND_TIMEOUT)
+
+def run_sheet_flusher():
+    while True:
+        with sheet_rows_condition:
+            while True:
+                if pending_sheet_rows:
+                    wait = pending_sheet_rows[0][0] + SHEET_FLUSH_INTERVAL - time.time()
+                    if len(pending_sheet_rows) >= SHEET_BATCH_SIZE or wait <= 0:
+                        break
+                    sheet_rows_condition.wait(wait)
+                else:
+                    sheet_rows_condition.wait()
+        flush_sheet_rows()
+
+def flush_sheet_rows():
+    with sheet_rows_condition:
+        batch = pending_sheet_rows[:]
+        del pending_sheet_rows[:]
+    if not batch:
+        return
+
+    batches_by_sheet = OrderedDict()
+    for _, spreadsheet_id, row, future in batch:
+        batches_by_sheet.setdefault(spreadsheet_id, []).append((row, future))
+
+    for spreadsheet_id, entries in batches_by_sheet.items():
+        try:
+            try:
+                result = append_rows(spreadsheet_id, [row for row, _ in entries])
+            except HttpError as e:
+                if not is_not_found_error(e):
+                    raise
+                invalidate_spreadsheet(spreadsheet_id)
+                spreadsheet_id = get_or_create_spreadsheet()
+                result = append_rows(spreadsheet_id, [row for row, _ in entries])
+            first_row = parse_first_row(result.get('updates', {}).get('updatedRange', ''))
+            logging.debug("Appended %s rows to %s starting at row %s", len(entries), spreadsheet_id, first_row)
+            for offset, (_, future) in enumerate(entries):
+                future.set_result(first_row + offset if first_row else None)
+        except Exception as e:
+            logging.error("Error appending %s rows to Google Sheet: %s", len(entries), e)
+            for _, future in entries:
+                future.set_exception(e)
+
+def append_rows(spreadsheet_id, rows):
+    # Retries quota (429) and server errors with exponential backoff, as uploads do, since every
+    # row in the batch belongs to a video that is already on Drive
+    retries = 0
+    while True:
+        try:
+            with stage_timer('sheet_append'):
+                result = get_sheets_service().spreadsheets().values().append(
+                    spreadsheetId=spreadsheet_id,
+                    range=f"{SHEET_NAME}!A:I",
+                    valueInputOption='RAW',
+                    insertDataOption='INSERT_ROWS',
+                    body={'values': rows}
+                ).execute()
+            break
+        except HttpError as e:
+            if e.resp.status not in RETRYABLE_STATUS_CODES or retries >= SHEET_APPEND_MAX_RETRIES:
+                raise
+            retries += 1
+            delay = min(2 ** retries, 64) + random.random()
+            logging.warning("Retryable error appending %s rows (%s), retry %s in %.1fs", len(rows), e, retries, delay)
+            inc_counter('sheet_append_retries_total', status=e.resp.status)
+            time.sleep(delay)
+    inc_counter('sheet_rows_appended_total', len(rows))
+    return result
+
+def parse_first_row(updated_range):
+    # "Queue!A101:I103" -> 101
+    match = re.search(r'!\$?[A-Z]+\$?(\d+)', updated_range)
+    return int(match.group(1)) if match else None
+
+atexit.register(flush_sheet_rows)
+
+# URL Dedup Index
+
+url_index = {
+    'spreadsheet_id': None,
+    'urls': set(),
+    'video_keys': set(),
+    'row_count': 0,
+    'refreshed_at': 0.0
+}
+url_index_lock = threading.Lock()
+in_flight = set()
+
+def normalize_url(url):
+    # Lowercase scheme and host, drop "www.", fragments and trailing slashes, and sort query parameters
+    if not url:
+        return ''
+    parsed = urlparse(url.strip())
+    netloc = parsed.netloc.lower()
+    if netloc.startswith('www.'):
+        netloc = netloc[4:]
+    path = parsed.path.rstrip('/') or '/'
+    query = urlencode(sorted(parse_qsl(parsed.query, keep_blank_values=True)))
+    return urlunparse(((parsed.scheme or 'https').lower(), netloc, path, '', query, ''))
+
+def canonicalize_url(url):
+    # Collapse short links, mobile hosts and tracking parameters to one URL per video
+    parsed = urlparse(normalize_url(url))
+    host = parsed.netloc
+    if host.startswith('m.'):
+        host = host[2:]
+    path = parsed.path
+    query = [(key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+             if key not in TRACKING_PARAMS and not key.startswith('utm_')]
+
+    if host == 'youtu.be':
+        host, path, query = 'youtube.com', '/watch', [('v', path.strip('/').split('/')[0])]
+    elif host == 'youtube.com' and re.match(r'^/(shorts|live|embed)/[^/]+$', path):
+        host, path, query = 'youtube.com', '/watch', [('v', path.split('/')[2])]
+    elif host == 'youtube.com' and path == '/watch':
+        query = [(key, value) for key, value in query if key == 'v']
+    elif host.endswith('tiktok.com') or host.endswith('instagram.com'):
+        query = []
+
+    return urlunparse(('https', host, path, '', urlencode(query), ''))
+
+def get_video_key(info):
+    # yt-dlp's (extractor_key, id) identifies a video regardless of which URL reached it
+    if not info or not info.get('extractor_key') or not info.get('id'):
+        return None
+    return (info['extractor_key'], str(info['id']))
+
+def video_key_from_url(url):
+    # Best-effort key for rows already in the sheet, so they can be matched without re-extracting
+    parsed = urlparse(canonicalize_url(url))
+    if parsed.netloc == 'youtube.com' and parsed.path == '/watch':
+        video_id = dict(parse_qsl(parsed.query)).get('v')
+        return ('Youtube', video_id) if video_id else None
+    match = re.match(r'^/@[^/]+/video/(\d+)', parsed.path)
+    if parsed.netloc.endswith('tiktok.com') and match:
+        return ('TikTok', match.group(1))
+    match = re.match(r'^/(?:[^/]+/)?(?:p|reels?|tv)/([^/]+)', parsed.path)
+    if parsed.netloc.endswith('instagram.com') and match:
+        return ('Instagram', match.group(1))
+    return None
+
+def refresh_url_index(sheets_service, spreadsheet_id, sheet_name, force=False):
+    # Loads column D once, then only reads rows past the last known row count after URL_INDEX_TTL
+    with url_index_lock:
+        if url_index['spreadsheet_id'] != spreadsheet_id:
+            url_index.update(spreadsheet_id=spreadsheet_id, urls=set(), video_keys=set(), row_count=0, refreshed_at=0.0)
+        if not force and url_index['refreshed_at'] and time.time() - url_index['refreshed_at'] < URL_INDEX_TTL:
+            return
+        start_row = url_index['row_count'] + 1
+
+    try:
+        result = sheets_service.spreadsheets().values().get(
+            spreadsheetId=spreadsheet_id,
+            range=f"{sheet_name}!D{start_row}:D"  # Assuming URLs are in column D
+        ).execute()
+    except HttpError as e:
+        if is_not_found_error(e):
+            invalidate_spreadsheet(spreadsheet_id)
+        raise
+    rows = result.get('values', [])
+
+    with url_index_lock:
+        if url_index['spreadsheet_id'] != spreadsheet_id:
+            return
+        for row in rows:
+            if not row:
+                continue
+            url_index['urls'].add(normalize_url(row[0]))
+            url_index['urls'].add(canonicalize_url(row[0]))
+            video_key = video_key_from_url(row[0])
+            if video_key:
+                url_index['video_keys'].add(video_key)
+        url_index['row_count'] = max(url_index['row_count'], start_row - 1 + len(rows))
+        url_index['refreshed_at'] = time.time()
+        logging.debug("URL index refreshed from row %s: %s new rows, %s URLs", start_row, len(rows), len(url_index['urls']))
+
+def is_url_indexed(sheets_service, spreadsheet_id, sheet_name, url):
+    refresh_url_index(sheets_service, spreadsheet_id, sheet_name)
+    with url_index_lock:
+        return normalize_url(url) in url_index['urls'] or canonicalize_url(url) in url_index['urls']
+
+def is_video_key_in_sheet(sheets_service, spreadsheet_id, sheet_name, video_key):
+    if not video_key:
+        return False
+    refresh_url_index(sheets_service, spreadsheet_id, sheet_name)
+    with url_index_lock:
+        return video_key in url_index['video_keys']
+
+def add_url_to_index(url, video_key=None):
+    # Called after a successful append; the row itself is picked up again by the next incremental refresh
+    if not url:
+        return
+    with url_index_lock:
+        url_index['urls'].add(normalize_url(url))
+        url_index['urls'].add(canonicalize_url(url))
+        if video_key:
+            url_index['video_keys'].add(video_key)
+
+def reserve_in_flight(keys):
+    # Stops two concurrent jobs for the same video from both downloading it
+    keys = [key for key in keys if key]
+    job_id = getattr(job_context, 'job_id', None)
+    if JOB_QUEUE_MODE == 'shared' and job_id:
+        return reserve_shared_keys(job_id, keys)
+    with url_index_lock:
+        if any(key in in_flight for key in keys):
+            return False
+        in_flight.update(keys)
+        return True
+
+def release_in_flight(keys):
+    job_id = getattr(job_context, 'job_id', None)
+    if JOB_QUEUE_MODE == 'shared' and job_id:
+        release_shared_keys(job_id)
+        return
+    with url_index_lock:
+        in_flight.difference_update(key for key in keys if key)
+
+# Shared Dedup Keys: in shared mode each worker process has its own in-flight set and URL index,
+# so URLs and video keys are reserved in the journal database instead. A reservation belongs to
+# a job id, so a worker taking over a stale claim can reserve the same keys again; once the row
+# is written the keys stay marked 'added' for SHARED_KEY_RETENTION, covering the window before
+# every process's URL index sees the new row.
+
+def encode_shared_key(key):
+    return encode_video_key(key) if isinstance(key, tuple) else canonicalize_url(key)
+
+def reserve_shared_keys(job_id, keys):
+    now = time.time()
+    encoded_keys = [encode_shared_key(key) for key in keys]
+    connection = get_job_journal()
+    with connection:
+        # Drop reservations of jobs no longer queued (finished, or failed without releasing) and expired additions
+        connection.execute("DELETE FROM shared_keys WHERE (state = 'in_flight' AND job_id NOT IN "
+                           "(SELECT job_id FROM job_queue)) OR (state = 'added' AND updated_at < ?)",
+                           (now - SHARED_KEY_RETENTION,))
+        connection.executemany("INSERT OR IGNORE INTO shared_keys (key, job_id, state, updated_at) "
+                               "VALUES (?, ?, 'in_flight', ?)", [(key, job_id, now) for key in encoded_keys])
+        placeholders = ', '.join('?' for _ in encoded_keys)
+        owners = connection.execute(f'SELECT job_id, state FROM shared_keys WHERE key IN ({placeholders})',
+                                    encoded_keys).fetchall()
+        if all(owner == (job_id, 'in_flight') for owner in owners):
+            return True
+        connection.execute("DELETE FROM shared_keys WHERE job_id = ? AND state = 'in_flight'", (job_id,))
+        return False
+
+def release_shared_keys(job_id):
+    connection = get_job_journal()
+    with connection:
+        connection.execute("DELETE FROM shared_keys WHERE job_id = ? AND state = 'in_flight'", (job_id,))
+
+def mark_shared_keys_added(keys):
+    now = time.time()
+    job_id = getattr(job_context, 'job_id', None)
+    connection = get_job_journal()
+    with connection:
+        connection.executemany("INSERT OR REPLACE INTO shared_keys (key, job_id, state, updated_at) "
+                               "VALUES (?, ?, 'added', ?)",
+                               [(encode_shared_key(key), job_id, now) for key in keys if key])
+
+def is_shared_key_added(key):
+    row = get_job_journal().execute("SELECT 1 FROM shared_keys WHERE key = ? AND state = 'added' AND updated_at >= ?",
+                                    (encode_shared_key(key), time.time() - SHARED_KEY_RETENTION)).fetchone()
+    return row is not None
+
+# Queue Snapshot: /queue is served from a local copy of the sheet. The spreadsheet's Drive
+# modifiedTime tells whether anything changed since the last refresh; if it did, one batchGet
+# reads the Status column of known rows (downstream tooling flips it) plus any rows past the
+# high-water mark, instead of downloading the whole range
+
+QUEUE_FIELDS = ['timestamp', 'platform', 'username', 'source_url', 'title', 'description', 'tags', 'drive_url', 'status']
+queue_snapshot = {
+    'spreadsheet_id': None,
+    'rows': [],  # Sheet rows 2.. as lists of QUEUE_HEADERS values
+    'modified_time': None,
+    'refreshed_at': 0.0,
+    'checked_at': 0.0
+}
+queue_snapshot_lock = threading.Lock()
+queue_snapshot_refresh_lock = threading.Lock()  # One refresh at a time; concurrent polls wait and reuse it
+
+def get_spreadsheet_modified_time(spreadsheet_id):
+    # None when Drive can't tell (e.g. drive.file scope on a sheet this app did not create)
+    try:
+        result = get_drive_service().files().get(fileId=spreadsheet_id, fields='modifiedTime').execute()
+        return result.get('modifiedTime')
+    except HttpError as e:
+        if is_not_found_error(e):
+            invalidate_spreadsheet(spreadsheet_id)
+            raise
+        logging.debug("Could not read spreadsheet modifiedTime: %s", e)
+        return None
+
+def refresh_queue_snapshot(force=False):
+    spreadsheet_id = get_spreadsheet_id()
+    if not spreadsheet_id:
+        raise RuntimeError('Spreadsheet not available')
+    with queue_snapshot_refresh_lock:
+        with queue_snapshot_lock:
+            if queue_snapshot['spreadsheet_id'] != spreadsheet_id:
+                queue_snapshot.update(spreadsheet_id=spreadsheet_id, rows=[], modified_time=None, refreshed_at=0.0,
+                                      checked_at=0.0)
+            if not force and time.time() - queue_snapshot['checked_at'] < QUEUE_SNAPSHOT_TTL:
+                return
+            row_count = len(queue_snapshot['rows'])
+            last_modified_time = queue_snapshot['modified_time']
+
+        modified_time = get_spreadsheet_modified_time(spreadsheet_id)
+        if not force and row_count and modified_time and modified_time == last_modified_time:
+            with queue_snapshot_lock:
+                queue_snapshot['checked_at'] = time.time()
+            inc_counter('queue_snapshot_refreshes_total', kind='unchanged')
+            return
+
+        if force:
+            row_count = 0
+        ranges = [f"{SHEET_NAME}!I2:I{row_count + 1}"] if row_count else []
+        ranges.append(f"{SHEET_NAME}!A{row_count + 2}:I")
+        try:
+            result = get_sheets_service().spreadsheets().values().batchGet(
+                spreadsheetId=spreadsheet_id, ranges=ranges).execute()
+        except HttpError as e:
+            if is_not_found_error(e):
+                invalidate_spreadsheet(spreadsheet_id)
+            raise
+        value_ranges = [value_range.get('values', []) for value_range in result.get('valueRanges', [])]
+        new_rows = [(row + [''] * len(QUEUE_HEADERS))[:len(QUEUE_HEADERS)] for row in value_ranges[-1]]
+
+        with queue_snapshot_lock:
+            rows = [] if force else queue_snapshot['rows'][:row_count]
+            if row_count:
+                statuses = value_ranges[0]
+                for index, row in enumerate(rows):
+                    row[8] = statuses[index][0] if index < len(statuses) and statuses[index] else ''
+            rows.extend(new_rows)
+            now = time.time()
+            queue_snapshot.update(rows=rows, modified_time=modified_time, refreshed_at=now, checked_at=now)
+        inc_counter('queue_snapshot_refreshes_total', kind='full' if not row_count else 'incremental')
+        logging.debug("Queue snapshot refreshed from row %s: %s new rows, %s total", row_count + 2, len(new_rows),
+                      len(rows))
+
+def get_queue_page(statuses=None, offset=0, limit=QUEUE_PAGE_SIZE):
+    # statuses is a set of lowercase Status values to keep, or None for every row
+    with queue_snapshot_lock:
+        rows = [(index + 2, row) for index, row in enumerate(queue_snapshot['rows'])
+                if not statuses or row[8].strip().lower() in statuses]
+        snapshot = dict(queue_snapshot)
+    return {
+        'total': len(rows),
+        'offset': offset,
+        'limit': limit,
+        'rows': [dict(zip(QUEUE_FIELDS, row), row=row_number) for row_number, row in rows[offset:offset + limit]],
+        'modified_time': snapshot['modified_time'],
+        'refreshed_at': snapshot['refreshed_at']
+    }
+
+# Queue Storage: the row-writing and dedup functions go through a store, so the queue can
+# live in the Google Sheet directly or in a local SQLite database mirrored to the sheet
+
+class SheetsQueueStore:
+    def add_row(self, row, video_key=None):
+        row_number = append_sheet_row(get_spreadsheet_id(), row)
+        add_url_to_index(row[3], video_key)
+        if JOB_QUEUE_MODE == 'shared':
+            # Other worker processes only see the row once their URL index refreshes
+            mark_shared_keys_added([row[3], video_key])
+        return row_number
+
+    def has_url(self, url):
+        if JOB_QUEUE_MODE == 'shared' and url and is_shared_key_added(url):
+            return True
+        return is_url_in_sheet(get_sheets_service(), get_spreadsheet_id(), SHEET_NAME, url)
+
+    def has_video_key(self, video_key):
+        if JOB_QUEUE_MODE == 'shared' and video_key and is_shared_key_added(video_key):
+            return True
+        return is_video_key_in_sheet(get_sheets_service(), get_spreadsheet_id(), SHEET_NAME, video_key)
+
+class SQLiteQueueStore:
+    # Rows are stored locally at once; a background thread appends unsynced rows to the sheet
+    # and records the sheet row number they landed on, which is also when the job that added the
+    # row learns its row. When mirroring, the rows already in the
+    # sheet are imported before the first dedup check or write, and retried until that succeeds.
+    # Worker processes sharing the database each run a mirror, so rows are claimed before they
+    # are appended, and claims left by a process that exited are released again.
+
+    active_claims = set()  # Mirror claim tokens held by this process
+
+    def __init__(self, path, mirror_to_sheets=True):
+        self.path = path
+        self.mirror_to_sheets = mirror_to_sheets
+        self.local = threading.local()
+        self.mirror_thread = None
+        self.mirror_wakeup = threading.Event()
+        self.import_lock = threading.Lock()
+        connection = self.connect()
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.executescript('''
+            CREATE TABLE IF NOT EXISTS queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT,
+                platform TEXT,
+                username TEXT,
+                source_url TEXT,
+                title TEXT,
+                description TEXT,
+                tags TEXT,
+                drive_url TEXT,
+                status TEXT,
+                canonical_url TEXT,
+                video_key TEXT,
+                sheet_row INTEGER,
+                synced INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS queue_source_url ON queue (source_url);
+            CREATE INDEX IF NOT EXISTS queue_canonical_url ON queue (canonical_url);
+            CREATE INDEX IF NOT EXISTS queue_video_key ON queue (video_key);
+            CREATE INDEX IF NOT EXISTS queue_status ON queue (status);
+            CREATE INDEX IF NOT EXISTS queue_synced ON queue (synced);
+            CREATE TABLE IF NOT EXISTS queue_meta (key TEXT PRIMARY KEY, value TEXT);
+        ''')
+        connection.commit()
+        add_missing_columns(connection, 'queue', [('mirror_claim', 'TEXT'), ('mirror_owner', 'TEXT'), ('job_id', 'TEXT')])
+        self.imported = not mirror_to_sheets or connection.execute(
+            "SELECT 1 FROM queue_meta WHERE key = 'sheet_imported_at'").fetchone() is not None
+        self.start_mirror()
+
+    def connect(self):
+        # One connection per thread; WAL lets readers proceed while another thread writes
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        return connection
+
+    def add_row(self, row, video_key=None):
+        # Returns None: the sheet row number is only known once the mirror has appended the row
+        self.ensure_imported()
+        row = (list(row) + [''] * len(QUEUE_HEADERS))[:len(QUEUE_HEADERS)]
+        connection = self.connect()
+        with connection:
+            connection.execute(
+                'INSERT INTO queue (timestamp, platform, username, source_url, title, description, tags, drive_url, '
+                'status, canonical_url, video_key, job_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                row + [canonicalize_url(row[3]), encode_video_key(video_key or video_key_from_url(row[3])),
+                       getattr(job_context, 'job_id', None)]
+            )
+        self.start_mirror()
+        return None
+
+    def has_url(self, url):
+        self.ensure_imported()
+        cursor = self.connect().execute(
+            'SELECT 1 FROM queue WHERE canonical_url = ? OR source_url = ? LIMIT 1', (canonicalize_url(url), url))
+        return cursor.fetchone() is not None
+
+    def has_video_key(self, video_key):
+        if not video_key:
+            return False
+        self.ensure_imported()
+        cursor = self.connect().execute('SELECT 1 FROM queue WHERE video_key = ? LIMIT 1', (encode_video_key(video_key),))
+        return cursor.fetchone() is not None
+
+    def start_mirror(self):
+        if not self.mirror_to_sheets:
+            return
+        self.mirror_wakeup.set()
+        if self.mirror_thread is None:
+            self.mirror_thread = threading.Thread(target=self.run_mirror, name='queue-mirror', daemon=True)
+            self.mirror_thread.start()
+
+    def run_mirror(self):
+        while True:
+            try:
+                self.ensure_imported()
+                if not self.mirror_pending_rows():
+                    self.mirror_wakeup.wait(QUEUE_MIRROR_INTERVAL)
+                    self.mirror_wakeup.clear()
+            except Exception as e:
+                logging.error("Error mirroring queue to Google Sheet: %s", e)
+                time.sleep(QUEUE_MIRROR_INTERVAL)
+
+    def mirror_pending_rows(self):
+        self.release_dead_claims()
+        connection = self.connect()
+        token = uuid.uuid4().hex
+        self.active_claims.add(token)
+        try:
+            # A single UPDATE keeps two mirrors from claiming the same row
+            with connection:
+                connection.execute(
+                    'UPDATE queue SET mirror_claim = ?, mirror_owner = ? WHERE id IN ('
+                    'SELECT id FROM queue WHERE synced = 0 AND mirror_claim IS NULL ORDER BY id LIMIT ?)',
+                    (token, json.dumps(get_job_owner()), SHEET_BATCH_SIZE))
+            pending = connection.execute(
+                'SELECT id, job_id, timestamp, platform, username, source_url, title, description, tags, drive_url, '
+                'status FROM queue WHERE mirror_claim = ? ORDER BY id', (token,)).fetchall()
+            if not pending:
+                return 0
+            spreadsheet_id = get_spreadsheet_id()
+            futures = [(row[0], row[1], queue_sheet_row(spreadsheet_id, list(row[2:]))) for row in pending]
+            for row_id, job_id, future in futures:
+                # Committed row by row, so a later failure does not send the appended ones again
+                sheet_row = future.result(timeout=SHEET_APPEND_TIMEOUT)
+                with connection:
+                    connection.execute('UPDATE queue SET synced = 1, sheet_row = ?, mirror_claim = NULL, '
+                                       'mirror_owner = NULL WHERE id = ?', (sheet_row, row_id))
+                if job_id:
+                    record_job_row(job_id, sheet_row)
+            logging.debug("Mirrored %s queue rows to Google Sheet", len(futures))
+            return len(futures)
+        finally:
+            with connection:
+                connection.execute('UPDATE queue SET mirror_claim = NULL, mirror_owner = NULL WHERE mirror_claim = ?',
+                                   (token,))
+            self.active_claims.discard(token)
+
+    def release_dead_claims(self):
+        owner = get_job_owner()
+        connection = self.connect()
+        claims = connection.execute(
+            'SELECT DISTINCT mirror_claim, mirror_owner FROM queue WHERE mirror_claim IS NOT NULL').fetchall()
+        for claim, claim_owner in claims:
+            claim_owner = json.loads(claim_owner) if claim_owner else None
+            # Our own pid with an unknown token is a previous process that had the same pid
+            held = claim in self.active_claims if claim_owner == owner else is_job_owner_alive(claim_owner)
+            if not held:
+                logging.warning("Releasing queue rows claimed by mirror %s, whose process has exited", claim)
+                with connection:
+                    connection.execute('UPDATE queue SET mirror_claim = NULL, mirror_owner = NULL WHERE mirror_claim = ?',
+                                       (claim,))
+
+    def ensure_imported(self):
+        # Raises while the import keeps failing, so dedup never answers from a half-seeded database
+        if self.imported:
+            return
+        with self.import_lock:
+            if not self.imported:
+                self.import_sheet_rows()
+                self.imported = True
+
+    def import_sheet_rows(self):
+        # Seeds the database from the existing sheet once, so dedup covers rows added before the switch.
+        # Rows this store already mirrored are recognised by their sheet row number and skipped.
+        spreadsheet_id = get_spreadsheet_id()
+        if not spreadsheet_id:
+            raise RuntimeError('Spreadsheet not available for the queue import')
+        try:
+            result = get_sheets_service().spreadsheets().values().get(
+                spreadsheetId=spreadsheet_id,
+                range=f"{SHEET_NAME}!A2:I"
+            ).execute()
+        except Exception as e:
+            logging.error("Error importing rows from Google Sheet: %s", e)
+            raise
+        rows = [(list(row) + [''] * len(QUEUE_HEADERS))[:len(QUEUE_HEADERS)] for row in result.get('values', [])]
+        connection = self.connect()
+        with connection:
+            # Takes the write lock before checking the marker, so processes starting together on a
+            # fresh database import once
+            connection.execute('BEGIN IMMEDIATE')
+            if connection.execute("SELECT 1 FROM queue_meta WHERE key = 'sheet_imported_at'").fetchone():
+                logging.debug("Google Sheet rows already imported into %s", self.path)
+                return
+            known_rows = {row[0] for row in connection.execute('SELECT sheet_row FROM queue WHERE sheet_row IS NOT NULL')}
+            imported = [row + [canonicalize_url(row[3]), encode_video_key(video_key_from_url(row[3])), index + 2]
+                        for index, row in enumerate(rows) if index + 2 not in known_rows]
+            connection.executemany(
+                'INSERT INTO queue (timestamp, platform, username, source_url, title, description, tags, drive_url, '
+                'status, canonical_url, video_key, sheet_row, synced) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)',
+                imported
+            )
+            connection.execute("INSERT OR REPLACE INTO queue_meta (key, value) VALUES ('sheet_imported_at', ?)",
+                               (datetime.now().isoformat(),))
+        logging.info("Imported %s rows from Google Sheet into %s", len(imported), self.path)
+
+def encode_video_key(video_key):
+    return f"{video_key[0]}:{video_key[1]}" if video_key else None
+
+queue_store = None
+queue_store_lock = threading.Lock()
+
+def get_queue_store():
+    global queue_store
+    with queue_store_lock:
+        if queue_store is None:
+            if QUEUE_BACKEND == 'sqlite':
+                queue_store = SQLiteQueueStore(QUEUE_DB_FILE, mirror_to_sheets=QUEUE_MIRROR_TO_SHEETS)
+            else:
+                queue_store = SheetsQueueStore()
+        return queue_store
+
 # Flask Routes
 
 @app.route('/', methods=['GET'])
@@ -530,23 +2910,170 @@ def home():
     logging.debug("Home route accessed.")
     return jsonify({'message': 'Welcome to the Video Batch Processor'})
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    # Readiness probe: triggers lazy credential and spreadsheet initialization on first call
+    logging.debug("Ready route accessed.")
+    checks = {}
+    try:
+        get_services()
+        checks['google'] = 'ok'
+    except Exception as e:
+        checks['google'] = str(e)
+    checks['spreadsheet'] = 'ok' if checks['google'] == 'ok' and get_spreadsheet_id() else 'not found'
+    is_ready = all(value == 'ok' for value in checks.values())
+    return jsonify({'ready': is_ready, 'checks': checks}), 200 if is_ready else 503
+
 @app.route('/process', methods=['POST'])
 def process_video():
     logging.debug("Process video route accessed.")
-    url = request.json.get('url')
-    process_url(url)
-    return jsonify({'message': 'Processing started'})
+    # Same answers as the ASGI route: the body is parsed as JSON whatever its content type
+    payload = request.get_json(force=True, silent=True)
+    if payload is None and request.get_data():
+        return jsonify({'error': 'Invalid JSON'}), 400
+    url = payload.get('url') if isinstance(payload, dict) else None
+    if not url:
+        return jsonify({'error': 'Missing url'}), 400
+    if count_pending_jobs() >= MAX_PENDING_JOBS:
+        logging.warning("Job queue is full, rejecting submission.")
+        return jsonify({'error': 'Job queue is full, try again later'}), 503
+    job = submit_job(url)
+    return jsonify({'message': 'Processing started', 'job_id': job['id'], 'status': job['status']}), 202
+
+@app.route('/process/batch', methods=['POST'])
+def process_batch():
+    logging.debug("Process batch route accessed.")
+    if request.is_json:
+        # Either {"urls": [...]} or a bare JSON list of URLs
+        payload = request.get_json(silent=True)
+        if isinstance(payload, list):
+            urls = payload
+        elif isinstance(payload, dict):
+            urls = payload.get('urls') or []
+        else:
+            return jsonify({'error': 'Expected a JSON object with urls or a JSON list of URLs'}), 400
+    else:
+        try:
+            urls = parse_url_list(request.get_data(as_text=True))
+        except ValueError as e:
+            return jsonify({'error': f'Invalid JSONL: {str(e)}'}), 400
+    if not urls or not isinstance(urls, list) or not all(isinstance(url, str) and url for url in urls):
+        return jsonify({'error': 'Missing urls'}), 400
+    if len(urls) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'Batch exceeds {MAX_BATCH_SIZE} URLs'}), 413
+    if count_pending_jobs() + len(urls) > MAX_PENDING_JOBS:
+        logging.warning("Job queue is full, rejecting batch.")
+        return jsonify({'error': 'Job queue is full, try again later'}), 503
+    batch_id, entries = submit_batch(urls)
+    return jsonify({
+        'message': 'Processing started',
+        'batch_id': batch_id,
+        'jobs': [{'url': url, 'job_id': job_id} for url, job_id in entries]
+    }), 202
+
+@app.route('/batches/<batch_id>', methods=['GET'])
+def batch_status(batch_id):
+    logging.debug("Batch status route accessed: %s", batch_id)
+    summary = get_batch_summary(batch_id)
+    if not summary:
+        return jsonify({'error': 'Batch not found'}), 404
+    return jsonify(summary)
+
+@app.route('/queue', methods=['GET'])
+def queue_status():
+    # Paginated view of the queue sheet, e.g. /queue?status=pending,failed&offset=100&limit=50
+    logging.debug("Queue route accessed.")
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = min(max(int(request.args.get('limit', QUEUE_PAGE_SIZE)), 1), QUEUE_PAGE_MAX)
+    except ValueError:
+        return jsonify({'error': 'offset and limit must be integers'}), 400
+    statuses = {status.strip().lower() for status in request.args.get('status', '').split(',') if status.strip()}
+    stale = False
+    try:
+        refresh_queue_snapshot(force=request.args.get('refresh') in ('1', 'true', 'yes'))
+    except Exception as e:
+        logging.error("Error refreshing queue snapshot: %s", e)
+        if not queue_snapshot['refreshed_at']:
+            return jsonify({'error': 'Queue not available'}), 503
+        stale = True
+    page = get_queue_page(statuses or None, offset, limit)
+    page['stale'] = stale
+    return jsonify(page)
+
+@app.route('/platforms', methods=['GET'])
+def platform_status():
+    logging.debug("Platform status route accessed.")
+    return jsonify(get_platform_stats())
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    if JOB_QUEUE_MODE == 'shared':
+        snapshot, job_counts, pending_rows = collect_process_metrics()
+    else:
+        snapshot = None
+        job_counts, pending_rows = get_local_gauges()
+    platform_stats = get_platform_stats()
+    gauges = {
+        'jobs': [({'status': status}, count) for status, count in sorted(job_counts.items())],
+        'pending_jobs': [({}, count_pending_jobs())],
+        'pending_sheet_rows': [({}, pending_rows)],
+        'platform_waiting': [({'platform': platform}, stats['waiting']) for platform, stats in platform_stats.items()],
+        'platform_active': [({'platform': platform}, stats['active']) for platform, stats in platform_stats.items()],
+        'platform_backoff_seconds': [({'platform': platform}, stats['backoff_seconds'])
+                                     for platform, stats in platform_stats.items()]
+    }
+    return Response(render_metrics(gauges, snapshot), mimetype='text/plain; version=0.0.4')
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    logging.debug("Job status route accessed: %s", job_id)
+    job = get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
 
 # Main
 
 def main():
     logging.debug("Main function called.")
     parser = argparse.ArgumentParser(description='Process video URLs.')
-    parser.add_argument('url', type=str, help='The URL of the video to process')
+    parser.add_argument('urls', type=str, nargs='*', help='The URLs of the videos to process')
+    parser.add_argument('--file', '-f', type=str, help='JSONL or plain-text file of URLs ("-" for stdin)')
+    parser.add_argument('--download-concurrency', type=int, default=DOWNLOAD_CONCURRENCY, help='Videos downloading at once')
+    parser.add_argument('--upload-concurrency', type=int, default=UPLOAD_CONCURRENCY, help='Videos uploading at once')
     args = parser.parse_args()
-    process_url(args.url)
+
+    urls = list(args.urls)
+    if args.file:
+        if args.file == '-':
+            urls.extend(parse_url_list(sys.stdin.read()))
+        else:
+            with open(args.file, 'r') as url_file:
+                urls.extend(parse_url_list(url_file.read()))
+    if not urls:
+        parser.error('No URLs given.')
+
+    set_stage_concurrency(args.download_concurrency, args.upload_concurrency)
+    with ThreadPoolExecutor(max_workers=args.download_concurrency + args.upload_concurrency,
+                            thread_name_prefix='batch-worker') as executor:
+        batch_id, _ = submit_batch(urls, executor)
+        # Jobs wait in their platform queue before reaching the executor, so shutdown alone would not wait for them
+        while not get_batch_summary(batch_id)['finished']:
+            time.sleep(0.5)
+    flush_sheet_rows()
+
+    summary = get_batch_summary(batch_id)
+    for result in summary['results']:
+        print(json.dumps(result))
+    logging.info("Batch finished: %s", summary['counts'])
+    return 0 if all(result['status'] in ('done', 'skipped') for result in summary['results']) else 1
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(main())
     logging.debug("App running.")
+    if RESUME_JOBS:
+        resume_jobs()
     port = int(os.environ.get("PORT", 8000))
     app.run(host="0.0.0.0", port=port)
@@ -0,0 +1,447 @@
+# Benchmark harness for the video pipeline, runnable offline.
+#
+# Drives process_url (or the /process route plus /jobs polling) with N concurrent submissions
+# against local stand-ins for yt-dlp, Drive and Sheets, and reports p50/p99 latency, videos
+# per minute and Google API calls per video. The stand-ins mimic the call shapes the pipeline
+# uses (files().create/list/delete, permissions().create, values().get/append/update) and add
+# configurable latency and a per-minute Sheets write quota.
+#
+#   python benchmark.py --videos 200 --concurrency 16
+#   python benchmark.py --mode http --backend sqlite --stream
+
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+
+import httplib2
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaUploadProgress
+
+import batch_download
+
+# Fake Google Services
+
+class FakeCall:
+    def __init__(self, backend, method, handler, latency):
+        self.backend = backend
+        self.method = method
+        self.handler = handler
+        self.latency = latency
+
+    def execute(self, *args, **kwargs):
+        self.backend.count(self.method)
+        time.sleep(self.latency)
+        return self.handler()
+
+class FakeUploadRequest(FakeCall):
+    # Behaves like a resumable googleapiclient HttpRequest: one round trip per chunk, with the
+    # total size taken from the media before the chunk is read, as next_chunk does
+    def __init__(self, backend, media, name, latency, bytes_per_second):
+        super().__init__(backend, 'drive.files.create', None, latency)
+        self.resumable = media
+        self.name = name
+        self.bytes_per_second = bytes_per_second
+        self.resumable_uri = None
+        self.resumable_progress = 0
+        self.http = FakeUploadHttp(self)
+
+    def next_chunk(self, num_retries=0):
+        self.backend.count(self.method)
+        if self.resumable_uri is None:
+            self.resumable_uri = f"https://fake-upload/{id(self)}"
+        size = self.resumable.size()
+        data = self.resumable.getbytes(self.resumable_progress, self.resumable.chunksize())
+        time.sleep(self.latency + len(data) / self.bytes_per_second)
+        if not data and self.resumable_progress:
+            # Drive rejects the bytes N-(N-1)/N range an empty chunk would carry
+            raise HttpError(httplib2.Response({'status': 400}), b'Failed to parse Content-Range header.')
+        self.resumable_progress += len(data)
+        if len(data) < self.resumable.chunksize() or (size is not None and self.resumable_progress >= size):
+            return None, self.backend.create_file(self.name, self.resumable_progress)
+        return MediaUploadProgress(self.resumable_progress, size or -1), None
+
+class FakeUploadHttp:
+    # Answers the empty bytes */N status and finalize requests sent to an upload session
+    def __init__(self, upload):
+        self.upload = upload
+
+    def request(self, uri, method='GET', headers=None, **kwargs):
+        upload = self.upload
+        upload.backend.count('drive.upload.status')
+        time.sleep(upload.latency)
+        total = headers['Content-Range'].rsplit('/', 1)[1]
+        if total != '*' and int(total) == upload.resumable_progress:
+            file = upload.backend.create_file(upload.name, upload.resumable_progress)
+            return httplib2.Response({'status': 200}), json.dumps(file).encode()
+        response = httplib2.Response({'status': 308})
+        if upload.resumable_progress:
+            response['range'] = f"bytes=0-{upload.resumable_progress - 1}"
+        return response, b''
+
+    def execute(self, *args, **kwargs):
+        response = None
+        while response is None:
+            _, response = self.next_chunk()
+        return response
+
+class FakeGoogleBackend:
+    def __init__(self, latency, upload_bytes_per_second, sheet_writes_per_minute):
+        self.latency = latency
+        self.upload_bytes_per_second = upload_bytes_per_second
+        self.sheet_writes_per_minute = sheet_writes_per_minute
+        self.rows = [list(batch_download.QUEUE_HEADERS)]
+        self.files = {}
+        self.calls = {}
+        self.writes = deque()
+        self.lock = threading.Lock()
+
+    def count(self, method):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+    def total_calls(self):
+        with self.lock:
+            return sum(self.calls.values())
+
+    def check_write_quota(self):
+        with self.lock:
+            now = time.time()
+            while self.writes and now - self.writes[0] > 60:
+                self.writes.popleft()
+            if self.sheet_writes_per_minute and len(self.writes) >= self.sheet_writes_per_minute:
+                raise HttpError(httplib2.Response({'status': 429}), b'Quota exceeded for write requests per minute')
+            self.writes.append(now)
+
+    def create_file(self, name, size):
+        with self.lock:
+            file_id = f"file{len(self.files) + 1}"
+            self.files[file_id] = {'name': name, 'size': size}
+        return {'id': file_id, 'webViewLink': f"https://drive.google.com/file/d/{file_id}/view"}
+
+    def get_values(self, range):
+        match = re.match(r"^[^!]+!([A-Z])(\d*):([A-Z])(\d*)$", range)
+        first_column, first_row, last_column = match.group(1), int(match.group(2) or 1), match.group(3)
+        start, end = ord(first_column) - ord('A'), ord(last_column) - ord('A') + 1
+        with self.lock:
+            values = [row[start:end] for row in self.rows[first_row - 1:]]
+        return {'values': values} if values else {}
+
+    def append_values(self, values):
+        self.check_write_quota()
+        with self.lock:
+            first_row = len(self.rows) + 1
+            self.rows.extend(values)
+        return {'updates': {'updatedRange': f"Queue!A{first_row}:I{first_row + len(values) - 1}",
+                            'updatedRows': len(values)}}
+
+    def services(self):
+        return FakeSheetsService(self), FakeDriveService(self)
+
+class FakeSheetsService:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def create(self, body=None, **kwargs):
+        return FakeCall(self.backend, 'sheets.spreadsheets.create', lambda: {'spreadsheetId': 'fake-sheet'}, self.backend.latency)
+
+    def get(self, spreadsheetId=None, range=None, **kwargs):
+        return FakeCall(self.backend, 'sheets.spreadsheets.values.get', lambda: self.backend.get_values(range), self.backend.latency)
+
+    def append(self, spreadsheetId=None, range=None, body=None, **kwargs):
+        return FakeCall(self.backend, 'sheets.spreadsheets.values.append',
+                        lambda: self.backend.append_values(body['values']), self.backend.latency)
+
+    def update(self, spreadsheetId=None, range=None, body=None, **kwargs):
+        return FakeCall(self.backend, 'sheets.spreadsheets.values.update', lambda: {}, self.backend.latency)
+
+class FakeDriveService:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def files(self):
+        return self
+
+    def permissions(self):
+        return FakePermissions(self.backend)
+
+    def list(self, **kwargs):
+        return FakeCall(self.backend, 'drive.files.list', lambda: {'files': [{'id': 'fake-sheet'}]}, self.backend.latency)
+
+    def create(self, body=None, media_body=None, **kwargs):
+        return FakeUploadRequest(self.backend, media_body, body['name'], self.backend.latency,
+                                 self.backend.upload_bytes_per_second)
+
+    def delete(self, fileId=None, **kwargs):
+        return FakeCall(self.backend, 'drive.files.delete', lambda: self.backend.files.pop(fileId, None), self.backend.latency)
+
+class FakePermissions:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def create(self, **kwargs):
+        return FakeCall(self.backend, 'drive.permissions.create', lambda: {}, self.backend.latency)
+
+# Fake yt-dlp
+
+class FakeResponse:
+    def __init__(self, path, bytes_per_second):
+        self.file = open(path, 'rb')
+        self.bytes_per_second = bytes_per_second
+
+    def read(self, size):
+        block = self.file.read(size)
+        if block:
+            time.sleep(len(block) / self.bytes_per_second)
+        else:
+            self.file.close()
+        return block
+
+class FakeYoutubeDL:
+    # Stands in for yt_dlp.YoutubeDL: every URL resolves to a generated local file
+    source_folder = None
+    extract_latency = 0.2
+    download_bytes_per_second = 50 * 1024 * 1024
+    video_size = 2 * 1024 * 1024
+
+    def __init__(self, params):
+        self.params = params
+
+    def extract_info(self, url, download=True):
+        time.sleep(self.extract_latency)
+        platform = batch_download.get_url_platform(url)
+        extractor_key, video_id = batch_download.video_key_from_url(url)
+        path = self.source_file(f"{extractor_key}_{video_id}")
+        info = {
+            'id': video_id,
+            'extractor_key': extractor_key,
+            'webpage_url': url,
+            'title': f"Benchmark video {video_id}",
+            'uploader': 'bench',
+            'uploader_id': 'bench',
+            'channel': 'bench',
+            'description': f"{platform} benchmark video",
+            'tags': ['benchmark'],
+            'ext': 'mp4',
+            'formats': [{'format_id': 'mp4', 'url': path, 'ext': 'mp4', 'protocol': 'https',
+                         'vcodec': 'h264', 'acodec': 'aac', 'filesize': os.path.getsize(path)}]
+        }
+        return self.process_ie_result(info, download) if download else info
+
+    def process_ie_result(self, info, download=True):
+        if download:
+            source = info['formats'][-1]['url']
+            response = FakeResponse(source, self.download_bytes_per_second)
+            # Like yt-dlp: write to a .part file, report progress after each block, then rename
+            filename = self.prepare_filename(info)
+            tmpfilename = f"{filename}.part"
+            downloaded_bytes = 0
+            with open(tmpfilename, 'wb') as video_file:
+                for block in iter(lambda: response.read(1024 * 1024), b''):
+                    video_file.write(block)
+                    downloaded_bytes += len(block)
+                    self.report_progress({'status': 'downloading', 'filename': filename, 'tmpfilename': tmpfilename,
+                                          'downloaded_bytes': downloaded_bytes})
+            os.replace(tmpfilename, filename)
+            self.report_progress({'status': 'finished', 'filename': filename, 'downloaded_bytes': downloaded_bytes})
+        return info
+
+    def report_progress(self, progress):
+        for hook in self.params.get('progress_hooks', []):
+            hook(progress)
+
+    def prepare_filename(self, info):
+        return self.params.get('outtmpl', '%(title)s.%(ext)s') % info
+
+    def sanitize_info(self, info):
+        return json.loads(json.dumps(info))
+
+    def urlopen(self, request):
+        return FakeResponse(request.url, self.download_bytes_per_second)
+
+    def close(self):
+        pass
+
+    def source_file(self, name):
+        # Random bytes per video, so the content index never treats two videos as reposts
+        path = os.path.join(self.source_folder, f"{name}.mp4")
+        if not os.path.exists(path):
+            with open(path, 'wb') as video_file:
+                video_file.write(os.urandom(self.video_size))
+        return path
+
+# Benchmark
+
+def make_urls(count, seed):
+    patterns = [
+        'https://www.tiktok.com/@bench/video/{}',
+        'https://www.instagram.com/reel/bench{}/',
+        'https://www.youtube.com/watch?v=bench{}'
+    ]
+    return [patterns[index % len(patterns)].format(seed + index) for index in range(count)]
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def run_direct(urls, concurrency):
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+    pending = list(urls)
+
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                url = pending.pop()
+            started_at = time.perf_counter()
+            video_path, info = batch_download.process_url(url)
+            with lock:
+                latencies.append(time.perf_counter() - started_at)
+                if not video_path or not info:
+                    failures.append(url)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    batch_download.flush_sheet_rows()
+    return latencies, failures
+
+def run_http(urls, concurrency):
+    client = batch_download.app.test_client()
+    job_ids = []
+    lock = threading.Lock()
+    pending = list(urls)
+
+    def submitter():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                url = pending.pop()
+            response = client.post('/process', json={'url': url})
+            with lock:
+                job_ids.append(response.get_json().get('job_id'))
+
+    threads = [threading.Thread(target=submitter) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    results = {}
+    while len(results) < len(job_ids):
+        for job_id in job_ids:
+            if job_id and job_id not in results:
+                job = client.get(f'/jobs/{job_id}').get_json()
+                if job['status'] in batch_download.FINISHED_JOB_STATUSES:
+                    results[job_id] = job
+        time.sleep(0.05)
+    batch_download.flush_sheet_rows()
+    latencies = [job['elapsed'] for job in results.values()]
+    failures = [job['url'] for job in results.values() if job['status'] != 'done']
+    return latencies, failures
+
+def configure(args, workdir):
+    os.chdir(workdir)
+    os.makedirs(batch_download.OUTPUT_FOLDER, exist_ok=True)
+    FakeYoutubeDL.source_folder = os.path.join(workdir, 'sources')
+    os.makedirs(FakeYoutubeDL.source_folder, exist_ok=True)
+    FakeYoutubeDL.extract_latency = args.extract_latency
+    FakeYoutubeDL.download_bytes_per_second = args.download_mbps * 1024 * 1024 / 8
+    FakeYoutubeDL.video_size = int(args.video_mb * 1024 * 1024)
+
+    backend = FakeGoogleBackend(args.api_latency, args.upload_mbps * 1024 * 1024 / 8, args.sheet_quota)
+    batch_download.set_services_factory(backend.services)
+    batch_download.ydl_factory = FakeYoutubeDL
+    batch_download.SPREADSHEET_ID = 'fake-sheet'
+    batch_download.QUEUE_BACKEND = args.backend
+    batch_download.STREAM_UPLOADS = args.stream
+    batch_download.UPLOAD_CHUNK_SIZE = 1024 * 1024
+    batch_download.SHEET_FLUSH_INTERVAL = args.flush_ms / 1000
+    if not args.platform_limits:
+        for limits in batch_download.PLATFORM_LIMITS.values():
+            limits.update(concurrency=args.concurrency, per_minute=100000)
+    batch_download.set_stage_concurrency(args.concurrency, args.concurrency)
+    batch_download.job_executor = batch_download.ThreadPoolExecutor(max_workers=args.concurrency)
+    batch_download.MAX_PENDING_JOBS = max(batch_download.MAX_PENDING_JOBS, args.videos)
+    return backend
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the video pipeline against local stand-ins.')
+    parser.add_argument('--videos', type=int, default=60, help='Number of URLs to submit')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent submissions and pipeline workers')
+    parser.add_argument('--mode', choices=('direct', 'http'), default='direct',
+                        help='Call process_url directly or go through POST /process and GET /jobs/<id>')
+    parser.add_argument('--backend', choices=('sheets', 'sqlite'), default='sheets', help='Queue storage backend')
+    parser.add_argument('--stream', action='store_true', help='Use streaming download-to-Drive uploads')
+    parser.add_argument('--platform-limits', action='store_true', help='Keep the real per-platform rate limits')
+    parser.add_argument('--video-mb', type=float, default=2, help='Size of each fake video')
+    parser.add_argument('--extract-latency', type=float, default=0.2, help='Seconds per metadata extraction')
+    parser.add_argument('--download-mbps', type=float, default=400, help='Fake download bandwidth, Mbit/s')
+    parser.add_argument('--upload-mbps', type=float, default=200, help='Fake Drive upload bandwidth, Mbit/s')
+    parser.add_argument('--api-latency', type=float, default=0.05, help='Seconds per fake Google API round trip')
+    parser.add_argument('--sheet-quota', type=int, default=60, help='Sheets writes per minute, 0 for unlimited')
+    parser.add_argument('--flush-ms', type=float, default=200, help='Batched sheet write interval')
+    parser.add_argument('--keep', action='store_true', help='Keep the temporary working directory')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    workdir = tempfile.mkdtemp(prefix='addvideo-bench-')
+    backend = configure(args, workdir)
+    urls = make_urls(args.videos, random.randint(0, 10 ** 9))
+
+    started_at = time.perf_counter()
+    runner = run_http if args.mode == 'http' else run_direct
+    latencies, failures = runner(urls, args.concurrency)
+    duration = time.perf_counter() - started_at
+
+    completed = len(latencies) - len(failures)
+    report = {
+        'mode': args.mode,
+        'backend': args.backend,
+        'stream': args.stream,
+        'videos': len(urls),
+        'concurrency': args.concurrency,
+        'completed': completed,
+        'failed': len(failures),
+        'duration_seconds': round(duration, 2),
+        'latency_p50_seconds': round(percentile(latencies, 0.5), 3),
+        'latency_p99_seconds': round(percentile(latencies, 0.99), 3),
+        'latency_mean_seconds': round(statistics.mean(latencies), 3) if latencies else 0.0,
+        'videos_per_minute': round(completed / duration * 60, 1) if duration else 0.0,
+        'api_calls_per_video': round(backend.total_calls() / completed, 2) if completed else None,
+        'api_calls': dict(sorted(backend.calls.items()))
+    }
+    print(json.dumps(report, indent=2))
+
+    os.chdir(tempfile.gettempdir())
+    if args.keep:
+        print(f"Working directory kept at {workdir}", file=sys.stderr)
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0 if not failures else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+# Worker entry point: runs N processes that pull jobs from the shared SQLite queue next to the
+# job journal, so yt-dlp parsing and uploads spread over every core instead of sharing one GIL.
+#
+# With --web the ASGI app (asgi.py) runs under uvicorn as one more process that only enqueues;
+# without it, point a separately started server at the same JOB_JOURNAL_FILE with
+# JOB_QUEUE_MODE=shared. Processes that die are restarted, and the jobs they held are taken over
+# once their claim goes stale. Platform limits (PLATFORM_LIMITS) and rate-limit backoff are kept
+# in the same database, so they apply to all processes together. The process count defaults to
+# WORKER_PROCESSES, then the platform's WEB_CONCURRENCY (sized for the dyno), then 2;
+# os.cpu_count() reports the host's CPUs on a dyno, not the dyno's share.
+#
+#   python worker.py --processes 4 --threads 4 --web
+
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+
+import batch_download
+
+batch_download.JOB_QUEUE_MODE = 'shared'  # Module level, so it also holds in spawned children
+
+def run_worker_process(threads):
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+    batch_download.run_worker(threads, stop_event)
+
+def run_web_process():
+    import uvicorn
+    import asgi
+    uvicorn.run(asgi.app, host="0.0.0.0", port=int(os.environ.get("PORT", 8000)))
+
+def start_process(name, target, args=()):
+    process = multiprocessing.Process(target=target, args=args, name=name)
+    process.start()
+    logging.info("Started %s (pid %s)", name, process.pid)
+    return process
+
+def main():
+    parser = argparse.ArgumentParser(description='Run worker processes for the shared job queue.')
+    parser.add_argument('--processes', type=int, default=int(os.environ.get('WORKER_PROCESSES', os.environ.get('WEB_CONCURRENCY', 2))),
+                        help='Worker processes to run')
+    parser.add_argument('--threads', type=int, default=batch_download.WORKER_COUNT,
+                        help='Concurrent jobs per worker process')
+    parser.add_argument('--web', action='store_true', help='Also run the HTTP server, which only enqueues')
+    args = parser.parse_args()
+
+    specs = {f"worker-{index}": (run_worker_process, (args.threads,)) for index in range(args.processes)}
+    if args.web:
+        specs['web'] = (run_web_process, ())
+    processes = {name: start_process(name, target, target_args) for name, (target, target_args) in specs.items()}
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+    while not stopping.wait(1):
+        for name, process in list(processes.items()):
+            if not process.is_alive():
+                logging.warning("%s exited with code %s, restarting", name, process.exitcode)
+                target, target_args = specs[name]
+                processes[name] = start_process(name, target, target_args)
+                time.sleep(1)
+
+    logging.info("Stopping %s processes", len(processes))
+    for process in processes.values():
+        if process.is_alive():
+            process.terminate()
+    for process in processes.values():
+        process.join()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())